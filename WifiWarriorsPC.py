@@ -1,16 +1,48 @@
-import pygame, sys, os, json, random, math, time
+import pygame, sys, os, json, random, math, time, bisect, heapq, threading, atexit, struct, csv, hashlib, weakref
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import MutableSequence
+try: import numpy as np
+except ImportError: np = None
 
 # --- 1. PC CONFIG & HARDWARE EMULATION ---
 SCALE = 4
 SCREEN_W, SCREEN_H = 160, 128
 WINDOW_W, WINDOW_H = SCREEN_W * SCALE, SCREEN_H * SCALE
 
-pygame.init()
-pygame.display.set_caption("WiFi Warriors: PC Edition")
-screen = pygame.display.set_mode((WINDOW_W, WINDOW_H))
-display_surface = pygame.Surface((SCREEN_W, SCREEN_H))
-clock = pygame.time.Clock()
-font = pygame.font.SysFont("Courier New", 10, bold=True)
+# Importing the module never touches SDL: the window, clock and font are made on first use (main(), the
+# first LCD or keyboard, or the first text drawn). WW_HEADLESS=1 or --headless uses SDL's dummy drivers.
+screen = None; display_surface = None; clock = None; font = None
+def init_display(headless=None):
+    global screen, display_surface, clock
+    if screen is None:
+        if os.environ.get("WW_HEADLESS") if headless is None else headless:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy"); os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+        pygame.init()
+        pygame.display.set_caption("WiFi Warriors: PC Edition")
+        screen = pygame.display.set_mode((WINDOW_W, WINDOW_H))
+        display_surface = pygame.Surface((SCREEN_W, SCREEN_H))
+        clock = pygame.time.Clock()
+    return display_surface
+def get_font():
+    # SysFont scans the installed fonts, so it only runs once something is actually written.
+    global font
+    if font is None: pygame.font.init(); font = pygame.font.SysFont("Courier New", 10, bold=True)
+    return font
+MAX_ON_FIELD = int(os.environ.get("WW_MAX_ON_FIELD", 12)) # walkers per side during a siege
+SIEGE_CORE = os.environ.get("WW_SIEGE_CORE", "object") # "array" runs sieges on the NumPy core
+PARTICLE_CAP = 2048 # live particles per battle before the oldest slots get recycled
+TEXT_CACHE_SIZE = 512 # rendered (text, color) surfaces kept by LCD.text
+SPRITE_CACHE_SIZE = 256 # rasterized unit looks kept by FantasyUnit.draw
+TEMPLATE_CACHE_SIZE = 4096 # (seed, level) unit rolls kept for re-scanned networks
+HISTORY_BLOOM_CAPACITY = int(os.environ.get("WW_HISTORY_BLOOM", 0)) # networks the seen-network Bloom filter is sized for (0 = off)
+SAVE_COALESCE_MS = 250 # a burst of army changes is collected this long before it is encoded and written
+SCAN_BATCH = 32 # scanned APs turned into encounter previews at a time
+SIM_HZ = 60 # battle ticks per second of game time, independent of the render rate
+FAST_FORWARD = (1, 2, 4, 8) # battle speeds cycled with LEFT/RIGHT
+MAX_STEPS_PER_FRAME = 32 # ticks one rendered frame may catch up before the backlog is dropped
+FRAME_CAP = int(os.environ.get("WW_FRAME_CAP", 60)) # frames per second LCD.show is held to (0 = uncapped)
+PROFILE_FRAMES = 600 # battle frames the profiler keeps for its CSV / Chrome trace export
+BATTLE_LOG_DIR = os.environ.get("WW_BATTLE_LOG") # directory every siege/duel is recorded to for replay (None = off)
 
 # --- COLORS ---
 BLACK, WHITE = (0,0,0), (255,255,255)
@@ -26,34 +58,175 @@ GOLD = (200,200,50)
 def color(r, g, b): return (r, g, b)
 
 # --- 2. DRIVERS ---
-class InputController:
-    def __init__(self):
-        self.last_press = 0
-        self.debounce_ms = 150 # PC keys are fast, need debounce
+class InputExhausted(Exception): pass
 
-    def get_input(self):
-        pygame.event.pump() # Keep window alive
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT: pygame.quit(); sys.exit()
-            
-        keys = pygame.key.get_pressed()
-        now = pygame.time.get_ticks()
-        
-        if now - self.last_press < self.debounce_ms: return None
-
-        if keys[pygame.K_UP]: self.last_press = now; return 'UP'
-        if keys[pygame.K_DOWN]: self.last_press = now; return 'DOWN'
-        if keys[pygame.K_LEFT]: self.last_press = now; return 'LEFT'
-        if keys[pygame.K_RIGHT]: self.last_press = now; return 'RIGHT'
-        if keys[pygame.K_z]: self.last_press = now; return 'A'
-        if keys[pygame.K_x]: self.last_press = now; return 'B'
+class KeyboardSource:
+    # Keys come from SDL KEYDOWN events; holding a key repeats it every repeat_ms.
+    # With record_path set, every key handed out is appended to a script ScriptSource can replay.
+    realtime = True
+    KEY_MAP = {pygame.K_UP: 'UP', pygame.K_DOWN: 'DOWN', pygame.K_LEFT: 'LEFT', pygame.K_RIGHT: 'RIGHT', pygame.K_z: 'A', pygame.K_x: 'B', pygame.K_F3: 'F3'}
+    def __init__(self, repeat_ms=150, record_path=None):
+        init_display(); pygame.key.set_repeat(repeat_ms * 2, repeat_ms)
+        self.record = open(record_path, "a") if record_path else None; self.idle = 0
+    def translate(self, event):
+        if event.type == pygame.QUIT: SAVES.flush(); pygame.quit(); sys.exit()
+        if event.type == pygame.KEYDOWN: return self.KEY_MAP.get(event.key)
         return None
-
-    def wait_for_input(self):
+    def deliver(self, k):
+        if self.record:
+            if k is None: self.idle += 1; return None
+            if self.idle: self.record.write(f"WAIT {self.idle}\n"); self.idle = 0
+            self.record.write(k + "\n"); self.record.flush()
+        return k
+    def poll(self):
+        k = None
+        for event in pygame.event.get():
+            k = self.translate(event) or k
+        return self.deliver(k)
+    def wait(self, timeout_ms=None):
+        # Sleeps in SDL until a key, a window expose or the timeout; None means "redraw if you need to".
+        deadline = None if timeout_ms is None else pygame.time.get_ticks() + timeout_ms
         while True:
-            k = self.get_input()
-            if k: return k
-            pygame.time.delay(10)
+            if deadline is None: event = pygame.event.wait()
+            else:
+                left = deadline - pygame.time.get_ticks()
+                if left <= 0: return None
+                event = pygame.event.wait(left)
+            if event.type == pygame.NOEVENT or event.type == pygame.WINDOWEXPOSED: return None
+            k = self.translate(event)
+            if k: return self.deliver(k)
+    def pause(self, ms): pygame.time.delay(ms)
+
+class QueueSource:
+    # Programmatic input: keys are handed out in order, None entries are idle polls.
+    # Nothing ever sleeps, so scripted runs go at full speed, and battles advance one frame per poll.
+    realtime = False
+    def __init__(self, keys=()): self.keys = deque(keys)
+    def push(self, *keys): self.keys.extend(keys)
+    def poll(self):
+        if not self.keys: raise InputExhausted()
+        return self.keys.popleft()
+    def wait(self, timeout_ms=None):
+        while self.keys:
+            k = self.keys.popleft()
+            if k is not None or timeout_ms is not None: return k
+        raise InputExhausted()
+    def pause(self, ms): pass
+
+class ScriptSource(QueueSource):
+    # One key per line (UP, DOWN, LEFT, RIGHT, A, B, or F3 for the profiler overlay); "WAIT n" adds n
+    # idle polls, '#' starts a comment.
+    def __init__(self, path):
+        keys = []
+        with open(path) as f:
+            for line in f:
+                tok = line.split("#")[0].split()
+                if not tok: continue
+                if tok[0].upper() == "WAIT": keys.extend([None] * int(tok[1]))
+                elif tok[0].upper() in ('UP', 'DOWN', 'LEFT', 'RIGHT', 'A', 'B', 'F3'): keys.append(tok[0].upper())
+                else: raise ValueError(f"{path}: bad input token {tok[0]!r}")
+        super().__init__(keys)
+
+class ReplaySource(QueueSource):
+    # A recorded battle's keys, one entry per frame, played back at wall-clock speed; idles once they run out.
+    realtime = True
+    def poll(self): return self.keys.popleft() if self.keys else None
+    def pause(self, ms): pygame.time.delay(ms)
+
+class InputController:
+    def __init__(self, source=None): self.source = source or KeyboardSource()
+    def get_input(self): return self.source.poll()
+    def wait_for_input(self, timeout_ms=None): return self.source.wait(timeout_ms)
+    def pause(self, ms): self.source.pause(ms)
+    @property
+    def realtime(self): return self.source.realtime
+
+# Scan sources yield AccessPoint(mac, ssid, signal) lazily, one line at a time, so multi-megabyte
+# war-driving logs stream straight into the game. mac is the BSSID as an int; signal is whatever
+# the tool reports (dBm for iw/CSV, 0-100 quality for nmcli).
+AccessPoint = namedtuple("AccessPoint", "mac ssid signal")
+SCAN_NAMES = ["Neighbor_WiFi", "FBI Surveillance", "NETGEAR99", "Starbucks_Guest", "iPhone Hotspot", "Linksys"]
+
+def parse_mac(text): return int(text.strip().replace(":", "").replace("-", ""), 16)
+
+def simulated_scan(count=5):
+    # The original fake scan: random SSIDs, and a random "MAC" that doubles as the encounter seed.
+    for _ in range(count): yield AccessPoint(random.randint(1000, 99999999), random.choice(SCAN_NAMES), None)
+
+def iw_scan(path):
+    # `iw dev <if> scan` dumps: a "BSS aa:bb:..(on wlan0)" line opens each AP, indented lines follow.
+    # An AP whose BSSID does not parse is dropped; a signal that is not a number is left unset.
+    mac = None; ssid = ""; signal = None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("BSS "):
+                if mac is not None: yield AccessPoint(mac, ssid, signal)
+                ssid = ""; signal = None
+                try: mac = parse_mac(line[4:21])
+                except ValueError: mac = None
+            elif mac is not None:
+                line = line.strip()
+                if line.startswith("SSID:"): ssid = line[5:].strip()
+                elif line.startswith("signal:"):
+                    try: signal = float(line[7:].split()[0])
+                    except (ValueError, IndexError): pass
+    if mac is not None: yield AccessPoint(mac, ssid, signal)
+
+def nmcli_scan(path):
+    # `nmcli -t -f BSSID,SSID,SIGNAL dev wifi` output: ':' separated, with the BSSID's colons escaped as "\:".
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if len(line) < 23: continue
+            rest = line[23:]; ssid, _, signal = rest.rpartition(":")
+            try: mac = parse_mac(line[:22].replace("\\", ""))
+            except ValueError: continue # header or other non-AP line
+            yield AccessPoint(mac, ssid.replace("\\:", ":"), int(signal) if signal.isdigit() else None)
+
+def csv_scan(path):
+    # Beacon logs with a header row naming MAC/BSSID, SSID and RSSI/signal columns (WiGLE exports
+    # put a "WigleWifi-..." line above the header, which is skipped).
+    with open(path, newline="", encoding="utf-8", errors="replace") as f:
+        first = f.readline()
+        if not first.startswith("WigleWifi"): f.seek(0)
+        reader = csv.reader(f); header = [h.strip().lower() for h in next(reader, [])]
+        col = lambda *names: next((header.index(n) for n in names if n in header), None)
+        i_mac = col("mac", "bssid"); i_ssid = col("ssid", "essid"); i_sig = col("rssi", "signal", "level")
+        if i_mac is None: raise ValueError(f"{path}: no MAC/BSSID column")
+        for row in reader:
+            if len(row) <= i_mac or not row[i_mac]: continue
+            sig = row[i_sig] if i_sig is not None and i_sig < len(row) else ""
+            try: mac = parse_mac(row[i_mac])
+            except ValueError: continue # malformed BSSID: skip the row like an empty MAC
+            try: signal = float(sig) if sig.strip() else None
+            except ValueError: signal = None # blank or odd RSSI cells keep the AP
+            yield AccessPoint(mac, row[i_ssid] if i_ssid is not None and i_ssid < len(row) else "", signal)
+
+def replay_scan(path):
+    # The game's own format, written by save_scan: one JSON object per line.
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip(): d = json.loads(line); yield AccessPoint(d['mac'], d.get('ssid', ""), d.get('signal'))
+
+def save_scan(aps, path):
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for ap in aps: f.write(json.dumps({"mac": ap.mac, "ssid": ap.ssid, "signal": ap.signal}) + "\n"); n += 1
+    return n
+
+SCAN_SOURCES = {"sim": simulated_scan, "iw": iw_scan, "nmcli": nmcli_scan, "csv": csv_scan, "replay": replay_scan}
+
+def open_scan(spec=None):
+    # "sim" or "<kind>:<path>", e.g. "iw:scan.txt"; WW_SCAN_SOURCE picks the source the game uses.
+    spec = spec or os.environ.get("WW_SCAN_SOURCE", "sim")
+    kind, _, path = spec.partition(":")
+    if kind not in SCAN_SOURCES: raise ValueError(f"unknown scan source {kind!r}")
+    return SCAN_SOURCES[kind](path) if path else SCAN_SOURCES[kind]()
+
+def dedupe_scan(aps):
+    seen = set()
+    for ap in aps:
+        if ap.mac not in seen: seen.add(ap.mac); yield ap
 
 class SoundEngine:
     def play(self, notes): pass
@@ -64,18 +237,70 @@ class SoundEngine:
     def sfx_win(self): pass
     def sfx_lose(self): pass
 
+class LRUCache:
+    def __init__(self, capacity):
+        self.capacity = capacity; self.data = OrderedDict(); self.hits = 0; self.misses = 0; self.evictions = 0
+    def __len__(self): return len(self.data)
+    def get(self, key):
+        v = self.data.get(key)
+        if v is None: self.misses += 1; return None
+        self.data.move_to_end(key); self.hits += 1; return v
+    def put(self, key, value):
+        self.data[key] = value; self.data.move_to_end(key)
+        if len(self.data) > self.capacity: self.data.popitem(last=False); self.evictions += 1
+        return value
+    def clear(self): self.data.clear()
+    def stats(self): return {"size": len(self.data), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+class TextCache:
+    # Whole strings are cached per (text, color). With a monospace font, runs of digits are blitted
+    # from a per-color strip of pre-rendered glyphs, so changing HUD numbers never hit font.render.
+    # Proportional fallback fonts kern digits, so there every string goes through the LRU as a whole.
+    DIGITS = "0123456789"
+    def __init__(self, fnt, capacity=None):
+        self.font = fnt; self.lru = LRUCache(capacity or TEXT_CACHE_SIZE); self.strips = {}; self.composed = 0
+        self.digit_x = [fnt.size(self.DIGITS[:i])[0] for i in range(len(self.DIGITS) + 1)]
+        self.monospace = fnt.size("i") == fnt.size("W") == fnt.size("0")
+    def render(self, txt, col):
+        key = (txt, col); s = self.lru.get(key)
+        if s is None: s = self.lru.put(key, self.font.render(txt, False, col))
+        return s
+    def strip(self, col):
+        s = self.strips.get(col)
+        if s is None: s = self.strips[col] = self.font.render(self.DIGITS, False, col)
+        return s
+    def draw(self, surface, txt, x, y, col):
+        if not self.monospace or not any("0" <= c <= "9" for c in txt): surface.blit(self.render(txt, col), (x, y)); return
+        self.composed += 1; strip = self.strip(col); h = strip.get_height(); run = ""
+        for c in txt + "\0":
+            if "0" <= c <= "9":
+                if run: s = self.render(run, col); surface.blit(s, (x, y)); x += s.get_width(); run = ""
+                d = ord(c) - 48; gx = self.digit_x[d]; gw = self.digit_x[d + 1] - gx
+                surface.blit(strip, (x, y), (gx, 0, gw, h)); x += gw
+            elif c != "\0": run += c
+        if run: surface.blit(self.render(run, col), (x, y))
+    def stats(self): return dict(self.lru.stats(), composed=self.composed, strips=len(self.strips))
+
+_text_cache = None
+def get_text_cache():
+    global _text_cache
+    if _text_cache is None or _text_cache.font is not font: _text_cache = TextCache(get_font())
+    return _text_cache
+
 class LCD:
-    def fill(self, col): display_surface.fill(col)
-    def fill_rect(self, x, y, w, h, col): pygame.draw.rect(display_surface, col, (int(x), int(y), int(w), int(h)))
-    def rect(self, x, y, w, h, col): pygame.draw.rect(display_surface, col, (int(x), int(y), int(w), int(h)), 1)
-    def line(self, x1, y1, x2, y2, col): pygame.draw.line(display_surface, col, (int(x1), int(y1)), (int(x2), int(y2)))
+    def __init__(self, surface=None): self.surface = surface if surface is not None else init_display()
+    def fill(self, col): self.surface.fill(col)
+    def fill_rect(self, x, y, w, h, col): pygame.draw.rect(self.surface, col, (int(x), int(y), int(w), int(h)))
+    def rect(self, x, y, w, h, col): pygame.draw.rect(self.surface, col, (int(x), int(y), int(w), int(h)), 1)
+    def line(self, x1, y1, x2, y2, col): pygame.draw.line(self.surface, col, (int(x1), int(y1)), (int(x2), int(y2)))
     def pixel(self, x, y, col):
-        if 0 <= x < SCREEN_W and 0 <= y < SCREEN_H: display_surface.set_at((int(x), int(y)), col)
+        if 0 <= x < SCREEN_W and 0 <= y < SCREEN_H: self.surface.set_at((int(x), int(y)), col)
     def text(self, txt, x, y, col):
-        s = font.render(str(txt), False, col); display_surface.blit(s, (x, y))
+        get_text_cache().draw(self.surface, str(txt), x, y, col if type(col) is tuple else tuple(col))
     def show(self):
-        scaled = pygame.transform.scale(display_surface, (WINDOW_W, WINDOW_H))
-        screen.blit(scaled, (0, 0)); pygame.display.flip(); clock.tick(60)
+        if screen is None: init_display()
+        scaled = pygame.transform.scale(self.surface, (WINDOW_W, WINDOW_H))
+        screen.blit(scaled, (0, 0)); pygame.display.flip(); clock.tick(FRAME_CAP)
 
 # --- 3. ASSETS & DATA ---
 ELEMENTS = {
@@ -85,13 +310,19 @@ ELEMENTS = {
     "SNOW":   {"col": WHITE,  "weak": "FIRE"},
     "POISON": {"col": MAGENTA, "weak": "FIRE"}
 }
+# Attacker x defender damage multipliers in percent. Hitting an element with what it is weak to does
+# WEAK_MULT; the extra last row/column is for elements the table doesn't know (neutral).
+WEAK_MULT = 150
+ELEMENT_IDS = {name: i for i, name in enumerate(ELEMENTS)}; NEUTRAL = len(ELEMENTS)
+ELEMENT_MULT = tuple(tuple(WEAK_MULT if d in ELEMENTS and ELEMENTS[d]['weak'] == a else 100 for d in (*ELEMENTS, None)) for a in (*ELEMENTS, None))
 
 def draw_forest_bg(lcd):
     lcd.fill_rect(0, 0, 160, 60, SKY_BLUE); lcd.fill_rect(0, 60, 160, 15, DARK_GREEN)
     lcd.fill_rect(0, 75, 160, 53, FOREST_GREEN); lcd.fill_rect(0, 0, 12, 128, BROWN); lcd.fill_rect(148, 0, 12, 128, BROWN)
-def draw_cave_bg(lcd):
+def draw_cave_bg(lcd, rng=None):
+    rng = rng or random.Random(BG_SEED) # scenery rolls must never consume the battle RNG stream
     lcd.fill_rect(0, 0, 160, 128, color(40, 40, 40)); lcd.fill_rect(0, 50, 160, 78, color(80, 80, 80)) 
-    for i in range(0, 160, 40): lcd.fill_rect(i, 0, 10, random.randint(10, 30), color(30, 30, 30))
+    for i in range(0, 160, 40): lcd.fill_rect(i, 0, 10, rng.randint(10, 30), color(30, 30, 30))
 def draw_lava_bg(lcd):
     lcd.fill_rect(0, 0, 160, 60, BLACK); lcd.fill_rect(0, 60, 160, 68, color(180, 0, 0)) 
     for i in range(0, 160, 20): lcd.line(i, 60, i+10, 128, color(255, 100, 0))
@@ -108,6 +339,29 @@ def draw_snow_bg(lcd):
 def draw_book_bg(lcd):
     lcd.fill(PAPER); lcd.rect(5, 5, 150, 118, BROWN); lcd.rect(7, 7, 146, 114, BROWN)
 
+BG_SEED = 0xCA7E
+BACKGROUNDS = {"FOREST": draw_forest_bg, "CAVE": draw_cave_bg, "LAVA": draw_lava_bg,
+               "CASTLE": draw_castle_bg, "SNOW": draw_snow_bg, "BOOK": draw_book_bg}
+
+class BackgroundCache:
+    # Each backdrop is painted once into an off-screen surface and blitted per frame afterwards.
+    # Everything is dropped when the target size or any backdrop color changes.
+    def __init__(self): self.surfaces = {}; self.key = None; self.renders = 0
+    def palette(self): return (SKY_BLUE, FOREST_GREEN, DARK_GREEN, BROWN, BLACK, WHITE, PAPER)
+    def get(self, kind, size):
+        key = (size, self.palette())
+        if key != self.key: self.surfaces.clear(); self.key = key
+        s = self.surfaces.get(kind)
+        if s is None:
+            s = self.surfaces[kind] = pygame.Surface(size); self.renders += 1
+            BACKGROUNDS.get(kind, draw_forest_bg)(LCD(s))
+        return s
+    def invalidate(self): self.surfaces.clear(); self.key = None
+
+BG_CACHE = BackgroundCache()
+def draw_background(lcd, kind):
+    lcd.surface.blit(BG_CACHE.get(kind, lcd.surface.get_size()), (0, 0))
+
 UNIT_DEFS = {
     "Peasant":    {"s": GREY, "h":10, "w":4,  "r":12, "e":"NATURE"},
     "Warrior":    {"s": GREY, "h":14, "w":8,  "r":10, "e":"WATER"},
@@ -197,6 +451,39 @@ WILD_POOL = ["Rat", "Bat", "Spider", "Slime", "Peasant", "Cultist", "Zombie", "S
     "Barbarian", "Samurai", "Mage", "Cleric", "Monk", "Druid", "Bard", "Necro", "Witch", 
     "Plague Doc", "Vampire", "Paladin", "Frost Witch"]
 
+# Compiled race records: everything the battle and draw paths read about a race, resolved once at load.
+SHAPE_HUMAN, SHAPE_BEAST, SHAPE_FLY, SHAPE_BLOB = range(4)
+SHAPES = {"HUMAN": SHAPE_HUMAN, "BEAST": SHAPE_BEAST, "FLY": SHAPE_FLY, "BLOB": SHAPE_BLOB}
+NECRO_RACES = frozenset(["Necro", "Lich", "Lich Lord", "Lich King"])
+DODGE_RACES = frozenset(["Ninja", "Ghost", "Bat", "Vampire", "Storm Crow"])
+RaceRecord = namedtuple("RaceRecord", "race col element range base_hp base_str scale width w h shape mitigation dodge necro weapon_name armor_name")
+
+def default_loadout(race, d):
+    weapon_name = "Training Sword"; armor_name = "Cloth Tunic"
+    if race in ["Mage", "Cleric", "Plague Doc", "Cultist", "Frost Witch"]: weapon_name = "Old Stick"; armor_name = "Tattered Robe"
+    if race in NECRO_RACES: weapon_name = "Skull Wand"; armor_name = "Tattered Robe"
+    if race in ["Witch", "Basilisk"]: weapon_name = "Hex Rod"; armor_name = "Tattered Robe"
+    if race in ["Druid", "Treant"]: weapon_name = "Oak Stave"; armor_name = "Druid Cloak"
+    if race in ["Monk", "War Drummer"]: weapon_name = "Iron Knuckles"; armor_name = "Tattered Robe"
+    if race in ["Archer", "Rogue", "Thief", "Falconer"]: weapon_name = "Short Bow"
+    if race == "Musketeer": weapon_name = "Musket"; armor_name = "Leather Vest"
+    if race == "Bombardier": weapon_name = "Bomb"; armor_name = "Leather Vest"
+    if race == "Bard": weapon_name = "Lute"; armor_name = "Silk Robe"
+    if race == "Beastmaster": weapon_name = "Whip"; armor_name = "Leather Vest"
+    if d.get('shape', 'HUMAN') in ["BEAST", "FLY", "BLOB"] or d.get('scale', 1.0) > 1.2: weapon_name = "Claws"; armor_name = "Hide"
+    if race == "Fire Elem": weapon_name = "Fire Bolt"; armor_name = "Tattered Robe"
+    return weapon_name, armor_name
+
+def compile_race(race, d):
+    # width is the unrounded hitbox used for melee edges; w/h are the rounded sprite size.
+    scale = d.get('scale', 1.0); width = d['w'] * scale
+    return RaceRecord(race, d['s'], d['e'], d['r'], d['h'], d.get('w', 5), scale, width, int(width), int(d['h'] * scale),
+                      SHAPES[d.get('shape', 'HUMAN')], 0.75 if scale >= 1.4 else (0.90 if scale >= 1.2 else 1.0),
+                      race in DODGE_RACES, race in NECRO_RACES, *default_loadout(race, d))
+
+RACES = {race: compile_race(race, d) for race, d in UNIT_DEFS.items()}
+def race_record(race): return RACES.get(race) or RACES["Warrior"] # unknown races (old saves) fall back to Warrior
+
 ITEM_TIERS = {
     "Rusty Sword":0, "Old Stick":0, "Tattered Robe":0, "Wood Axe":0, "Cloth Tunic":0,
     "Iron Broadsword":1, "Apprentice Wand":1, "Leather Vest":1, "Battle Axe":1, "Short Bow":1,
@@ -247,6 +534,15 @@ RECIPES = [
     {"type":"SPELL", "name":"War Cry", "req":{"Barbarian":3}, "cd":500, "buff":"SPD", "val":2, "fx":RED},
 ]
 
+# Timed walker effects. Each gets a bit in Walker.flags; "every" + "tick" makes it a periodic event
+# run by the battle's StatusBoard, so new effects never touch Walker.update.
+STATUS_EFFECTS = {
+    "SHIELD": {}, "SPD": {}, "DEF": {}, "EXPLODE_ON_DEATH": {},
+    "POISON": {"every": 31, "tick": lambda w: w.take_damage(1, False)},
+}
+STATUS_BITS = {name: 1 << i for i, name in enumerate(STATUS_EFFECTS)}
+ST_SHIELD = STATUS_BITS["SHIELD"]; ST_SPD = STATUS_BITS["SPD"]
+
 FUSION_RESULTS = {
     "GOLEM": {0: "Earth Golem", 2: "Rust Golem", 4: "Iron Golem", 6: "The Colossus"},
     "UNDEAD": {0: "Abomination", 3: "Lich Lord", 6: "Grave Titan"},
@@ -342,9 +638,50 @@ MERCHANT_ITEMS = {
     "Holy Grail":     {"hp": 100, "str": 0, "col": GOLD, "cost": 5000},
     "Cursed Crown":   {"hp": 0,   "str": 10,"col": MAGENTA, "cost": 5000},
 }
-WEAPONS.update({k:v for k,v in MERCHANT_ITEMS.items() if "dmg" in v})
-ARMORS.update({k:v for k,v in MERCHANT_ITEMS.items() if "def" in v})
-ARTIFACTS.update({k:v for k,v in MERCHANT_ITEMS.items() if "hp" in v})
+for name, item in MERCHANT_ITEMS.items():
+    if "dmg" in item: WEAPONS[name] = item
+    elif "def" in item: ARMORS[name] = item
+    elif "hp" in item: ARTIFACTS[name] = item
+STARTER_GEAR = frozenset(["Cloth Tunic", "Tattered Robe", "Training Sword", "Old Stick", "Wood Axe"])
+
+class EquipmentCatalog:
+    # Class -> usable gear per table, cheapest first (ties keep table order, as the shop always listed
+    # them). Alongside each list is a running "best stat so far" index, so the best item a class can
+    # afford is one bisect on cost. Item class lists are frozen to sets for membership tests.
+    STAT = {"weapon": "dmg", "armor": "def"}
+    def __init__(self, tables):
+        self.tables = tables; self.items = {}; self.costs = {}; self.best = {}
+        for kind, table in tables.items():
+            stat = self.STAT[kind]; by_class = {}
+            for name, item in table.items(): item['classes'] = frozenset(item.get('classes', ()))
+            for name in sorted(table, key=lambda n: table[n]['cost']):
+                for c in table[name]['classes']: by_class.setdefault(c, []).append(name)
+            for c, names in by_class.items():
+                best = []; top = None
+                for i, name in enumerate(names):
+                    if top is None or table[name][stat] > table[names[top]][stat]: top = i
+                    best.append(top)
+                self.items[kind, c] = tuple(names); self.costs[kind, c] = [table[n]['cost'] for n in names]; self.best[kind, c] = best
+    def for_class(self, kind, race): return self.items.get((kind, race), ())
+    def usable(self, kind, name, race):
+        item = self.tables[kind].get(name)
+        return item is not None and (not item['classes'] or race in item['classes'])
+    def best_affordable(self, kind, race, gold):
+        i = bisect.bisect_right(self.costs.get((kind, race), ()), gold) - 1
+        return None if i < 0 else self.items[kind, race][self.best[kind, race][i]]
+    def best_upgrades(self, units, kind, gold):
+        # {unit: item} for every unit whose best affordable item beats what it has; one lookup per class.
+        table = self.tables[kind]; stat = self.STAT[kind]; attr = kind + "_name"; picks = {}; out = {}
+        for u in units:
+            race = u.race
+            if race not in picks: picks[race] = self.best_affordable(kind, race, gold)
+            name = picks[race]
+            if name is None: continue
+            have = table.get(getattr(u, attr))
+            if have is None or table[name][stat] > have[stat]: out[u] = name
+        return out
+
+EQUIPMENT = EquipmentCatalog({"weapon": WEAPONS, "armor": ARMORS})
 
 DUNGEONS = [
     {"name": "Rat Cellar",    "lvl": 1, "waves": 6, "reward": 50,  "type": "CAVE"},
@@ -366,24 +703,63 @@ DUNGEONS = [
 ]
 
 # --- 4. LOGIC CLASSES ---
-class Particle:
-    def __init__(self, x, y, color, mode="PIXEL", text="", vx=None, vy=None, grav=0.4):
-        self.x = x; self.y = y; self.col = color; self.mode = mode; self.text = text
-        self.life = random.randint(15, 40); self.grav = grav 
+class ParticlePool:
+    # Fixed-capacity particle columns with free-list reuse; a full pool recycles slots ring-wise.
+    # A slot is live while life > 0. NumPy (when installed) batches the update and the pixel blit.
+    # rng is the battle's random stream (the module by default); spawn_spell_fx draws from it too.
+    def __init__(self, capacity=None, rng=random):
+        n = self.capacity = capacity or PARTICLE_CAP; self.rng = rng
+        if np is not None:
+            self.x = np.zeros(n); self.y = np.zeros(n); self.vx = np.zeros(n); self.vy = np.zeros(n); self.grav = np.zeros(n)
+            self.life = np.zeros(n, np.int32); self.col = np.zeros((n, 3), np.uint8); self.is_text = np.zeros(n, bool)
+        else:
+            self.x = [0.0] * n; self.y = [0.0] * n; self.vx = [0.0] * n; self.vy = [0.0] * n; self.grav = [0.0] * n
+            self.life = [0] * n; self.col = [BLACK] * n; self.is_text = [False] * n
+        self.text = [None] * n; self.free = list(range(n - 1, -1, -1)); self.ring = 0
+    def __len__(self): return self.capacity - len(self.free)
+    def emit(self, x, y, color, mode="PIXEL", text="", vx=None, vy=None, grav=0.4):
+        rng = self.rng; life = rng.randint(15, 40)
         if vx is None:
-            if self.mode == "PIXEL": self.vx = random.uniform(-2.0, 2.0); self.vy = random.uniform(-3.0, -1.0)
-            else: self.vx = 0; self.vy = -0.5; self.grav = 0
-        else: self.vx = vx; self.vy = vy
+            if mode == "PIXEL": vx = rng.uniform(-2.0, 2.0); vy = rng.uniform(-3.0, -1.0)
+            else: vx = 0; vy = -0.5; grav = 0
+        if self.free: i = self.free.pop()
+        else: i = self.ring; self.ring = (self.ring + 1) % self.capacity
+        self.x[i] = x; self.y[i] = y; self.vx[i] = vx; self.vy[i] = vy; self.grav[i] = grav
+        self.life[i] = life; self.col[i] = color; self.is_text[i] = mode == "TEXT"; self.text[i] = text
     def update(self):
-        self.x += self.vx; self.y += self.vy; self.vy += self.grav; self.life -= 1
-        return self.life > 0
+        if len(self.free) == self.capacity: return
+        if np is not None:
+            a = self.life > 0
+            self.x[a] += self.vx[a]; self.y[a] += self.vy[a]; self.vy[a] += self.grav[a]; self.life[a] -= 1
+            self.free.extend(np.flatnonzero(a & (self.life <= 0)).tolist())
+        else:
+            for i in range(self.capacity):
+                if self.life[i] <= 0: continue
+                self.x[i] += self.vx[i]; self.y[i] += self.vy[i]; self.vy[i] += self.grav[i]; self.life[i] -= 1
+                if self.life[i] <= 0: self.free.append(i)
     def draw(self, lcd):
-        if self.mode == "PIXEL": 
-            lcd.pixel(int(self.x), int(self.y), self.col)
-            if self.grav > 0.1: lcd.pixel(int(self.x)+1, int(self.y), self.col)
-        else: lcd.text(self.text, int(self.x), int(self.y), self.col)
+        if len(self.free) == self.capacity: return
+        w, h = lcd.surface.get_size()
+        if np is not None:
+            a = (self.life > 0) & ~self.is_text
+            xs = self.x[a].astype(np.intp); ys = self.y[a].astype(np.intp); cols = self.col[a]; wide = self.grav[a] > 0.1
+            xs = np.concatenate((xs, xs[wide] + 1)); ys = np.concatenate((ys, ys[wide])); cols = np.concatenate((cols, cols[wide]))
+            on = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+            px = pygame.surfarray.pixels3d(lcd.surface); px[xs[on], ys[on]] = cols[on]; del px
+            texts = np.flatnonzero((self.life > 0) & self.is_text).tolist()
+        else:
+            px = pygame.PixelArray(lcd.surface); texts = []
+            for i in range(self.capacity):
+                if self.life[i] <= 0: continue
+                if self.is_text[i]: texts.append(i); continue
+                x = int(self.x[i]); y = int(self.y[i])
+                if 0 <= x < w and 0 <= y < h: px[x, y] = self.col[i]
+                if self.grav[i] > 0.1 and 0 <= x + 1 < w and 0 <= y < h: px[x + 1, y] = self.col[i]
+            px.close()
+        for i in texts: lcd.text(self.text[i], int(self.x[i]), int(self.y[i]), tuple(int(c) for c in self.col[i]))
 
 class Projectile:
+    __slots__ = ("x", "y", "target", "damage", "is_crit", "element", "speed", "active", "col", "is_arrow", "vx", "vy")
     def __init__(self, start_x, start_y, target_walker, damage, is_crit, element):
         self.x = start_x; self.y = start_y; self.target = target_walker
         self.damage = damage; self.is_crit = is_crit; self.element = element; self.speed = 4; self.active = True
@@ -402,71 +778,79 @@ class Projectile:
         self.target.take_damage(self.damage, self.is_crit)
         p_col = WHITE if not self.is_crit else YELLOW
         txt = str(self.damage) + ("!" if self.is_crit else "")
-        particle_list.append(Particle(self.target.x, self.target.y - 8, p_col, "TEXT", txt))
+        particle_list.emit(self.target.x, self.target.y - 8, p_col, "TEXT", txt)
         blood_col = ELEMENTS[self.target.unit.element]['col']
-        for _ in range(6): particle_list.append(Particle(self.target.x+5, self.target.y+5, blood_col, "PIXEL"))
+        for _ in range(6): particle_list.emit(self.target.x+5, self.target.y+5, blood_col, "PIXEL")
     def draw(self, lcd):
         if self.is_arrow:
             lcd.line(int(self.x), int(self.y), int(self.x-self.vx), int(self.y-self.vy), BROWN)
             lcd.pixel(int(self.x), int(self.y), WHITE) 
         else: lcd.fill_rect(int(self.x), int(self.y), 3, 3, self.col)
 
+UnitTemplate = namedtuple("UnitTemplate", "race element level max_hp str range name weapon_name armor_name dna")
+
+def make_template(race, level, dna):
+    r = race_record(race)
+    max_hp = int((r.base_hp + (level * 10)) * r.scale)
+    strength = int((r.base_str + (level * 2)) * r.scale)
+    return UnitTemplate(r.race, r.element, level, max_hp, strength, r.range, r.race, r.weapon_name, r.armor_name, dna)
+
+TEMPLATES = LRUCache(TEMPLATE_CACHE_SIZE)
+
+def unit_template(seed, level_scale=1, manual_type=None):
+    # Seeded units (scanned networks) roll on their own Random, so the same network always gives the
+    # same unit and global randomness is never reseeded; rolls are memoized per (seed, level, type).
+    key = (seed, level_scale, manual_type); t = TEMPLATES.get(key)
+    if t is None:
+        rng = random.Random(seed); race = manual_type or rng.choice(WILD_POOL)
+        t = TEMPLATES.put(key, make_template(race, level_scale, rng.randint(0, 100)))
+    return t
+
+class StatField:
+    # A FantasyUnit attribute that feeds its combat stats: setting it drops the cached stats tuple.
+    __slots__ = ("slot",)
+    def __set_name__(self, owner, name): self.slot = owner.__dict__["_" + name]
+    def __get__(self, u, owner=None): return self if u is None else self.slot.__get__(u)
+    def __set__(self, u, value): self.slot.__set__(u, value); u.stats = None
+
 class FantasyUnit:
-    def __init__(self, seed=None, load_data=None, manual_type=None, level_scale=1):
-        self.temp_str = 0; self.temp_def = 0; self.has_lifesteal = False; self.is_fanatic = False
+    # Units, walkers and projectiles are slotted: armies and busy fields hold thousands of them.
+    __slots__ = ("_temp_str", "_temp_def", "has_lifesteal", "is_fanatic", "cd", "flash_timer", "is_firing", "dna", "race", "level", "xp",
+                 "hp", "max_hp", "_str", "name", "range", "_element", "_weapon_name", "_armor_name", "_artifact", "rec", "stats")
+    temp_str = StatField(); temp_def = StatField(); str = StatField(); element = StatField()
+    weapon_name = StatField(); armor_name = StatField(); artifact = StatField()
+    def __init__(self, seed=None, load_data=None, manual_type=None, level_scale=1, rng=random):
+        self.stats = None; self.temp_str = 0; self.temp_def = 0; self.has_lifesteal = False; self.is_fanatic = False
         self.cd = 0; self.flash_timer = 0; self.is_firing = False
         
         if load_data:
-            self.dna = load_data.get('dna', random.randint(0, 100))
+            self.dna = load_data['dna'] if 'dna' in load_data else random.randint(0, 100) # only old saves without dna draw
             self.race = load_data['r']; self.level = load_data['l']; self.xp = load_data['x']; self.hp = load_data['hp']
             self.max_hp = load_data['mhp']; self.str = load_data['s']; self.name = load_data['n']; self.range = load_data['rng']
             if 'el' in load_data: self.element = load_data['el']
-            else: self.element = UNIT_DEFS.get(self.race, UNIT_DEFS["Warrior"])['e']
+            else: self.element = race_record(self.race).element
             self.weapon_name = load_data.get('wpn', "Training Sword"); self.armor_name = load_data.get('arm', "Cloth Tunic")
             self.artifact = load_data.get('art', None)
         else:
-            self.dna = random.randint(0, 100) 
-            if seed: random.seed(seed)
-            if manual_type: self.race = manual_type
-            else: self.race = random.choice(WILD_POOL)
-                
-            if self.race not in UNIT_DEFS: self.race = "Warrior"
-            d = UNIT_DEFS[self.race]; self.element = d['e']; self.level = level_scale; self.xp = 0
-            
-            base_hp = d['h']; base_str = d.get('w', 5)
-            scale_mult = d.get('scale', 1.0)
-            
-            self.max_hp = int((base_hp + (self.level * 10)) * scale_mult)
-            self.str = int((base_str + (self.level * 2)) * scale_mult)
-            self.hp = self.max_hp
-            
-            self.range = d['r']; self.name = f"{self.race}"
-            self.weapon_name = "Training Sword"; self.armor_name = "Cloth Tunic"
-            
-            if self.race in ["Mage", "Cleric", "Plague Doc", "Cultist", "Frost Witch"]: self.weapon_name = "Old Stick"; self.armor_name = "Tattered Robe"
-            if self.race in ["Necro", "Lich", "Lich Lord", "Lich King"]: self.weapon_name = "Skull Wand"; self.armor_name = "Tattered Robe"
-            if self.race in ["Witch", "Basilisk"]: self.weapon_name = "Hex Rod"; self.armor_name = "Tattered Robe"
-            if self.race in ["Druid", "Treant"]: self.weapon_name = "Oak Stave"; self.armor_name = "Druid Cloak"
-            if self.race in ["Monk", "War Drummer"]: self.weapon_name = "Iron Knuckles"; self.armor_name = "Tattered Robe"
-            if self.race in ["Archer", "Rogue", "Thief", "Falconer"]: self.weapon_name = "Short Bow"
-            if self.race == "Musketeer": self.weapon_name = "Musket"; self.armor_name = "Leather Vest"
-            if self.race == "Bombardier": self.weapon_name = "Bomb"; self.armor_name = "Leather Vest"
-            if self.race == "Bard": self.weapon_name = "Lute"; self.armor_name = "Silk Robe"
-            if self.race == "Beastmaster": self.weapon_name = "Whip"; self.armor_name = "Leather Vest"
-            
-            d_shape = d.get('shape', 'HUMAN')
-            if d_shape in ["BEAST", "FLY", "BLOB"] or d.get('scale', 1.0) > 1.2: self.weapon_name = "Claws"; self.armor_name = "Hide"
-            if self.race == "Fire Elem": self.weapon_name = "Fire Bolt"; self.armor_name = "Tattered Robe"
-            self.artifact = None
-            if seed: random.seed(time.time())
+            if seed: t = unit_template(seed, level_scale, manual_type)
+            else:
+                dna = rng.randint(0, 100)
+                t = make_template(manual_type or rng.choice(WILD_POOL), level_scale, dna)
+            self.race, self.element, self.level, self.max_hp, self.str, self.range, self.name, self.weapon_name, self.armor_name, self.dna = t
+            self.xp = 0; self.hp = self.max_hp; self.artifact = None
+        self.rec = race_record(self.race)
             
-    def get_power(self):
-        dmg = WEAPONS.get(self.weapon_name, {'dmg':0})['dmg']
-        bonus = ARTIFACTS[self.artifact]['str'] if self.artifact else 0
-        return self.str + dmg + bonus + self.temp_str
-    def get_defense(self): 
-        base = ARMORS.get(self.armor_name, {'def':0})['def']
-        return base + self.temp_def
+    def combat_stats(self):
+        # (power, defense, element id), rebuilt only after gear, strength, element or a temp buff changes.
+        s = self.stats
+        if s is None:
+            dmg = WEAPONS.get(self.weapon_name, {'dmg':0})['dmg']
+            bonus = ARTIFACTS[self.artifact]['str'] if self.artifact else 0
+            base = ARMORS.get(self.armor_name, {'def':0})['def']
+            s = self.stats = (self.str + dmg + bonus + self.temp_str, base + self.temp_def, ELEMENT_IDS.get(self.element, NEUTRAL))
+        return s
+    def get_power(self): return (self.stats or self.combat_stats())[0]
+    def get_defense(self): return (self.stats or self.combat_stats())[1]
     def reset_buffs(self):
         self.temp_str = 0; self.temp_def = 0; self.has_lifesteal = False; self.is_fanatic = False
     def gain_xp(self, amount):
@@ -478,17 +862,27 @@ class FantasyUnit:
         return {'r': self.race, 'l': self.level, 'x': self.xp, 'hp': self.hp, 'mhp': self.max_hp, 's': self.str, 
                 'n': self.name, 'rng': self.range, 'el': self.element, 'wpn': self.weapon_name, 'arm': self.armor_name, 'art': self.artifact, 'dna': self.dna}
     def draw(self, lcd, x, y, side="LEFT"):
-        d = UNIT_DEFS.get(self.race, UNIT_DEFS["Warrior"])
-        shape = d.get('shape', 'HUMAN')
-        scale = d.get('scale', 1.0)
-        body_col = d['s']
+        flash = self.flash_timer > 0
+        if flash: self.flash_timer -= 1
+        sprite, ox, oy = SPRITES.get(self, side, flash)
+        lcd.surface.blit(sprite, (x + ox, y + oy))
+    def rasterize(self, side, flash):
+        w = self.rec.w; h = self.rec.h; pad = SpriteCache.PAD
+        surf = pygame.Surface((w + 2 * pad, max(h + 2, 24) + 2 * pad)); surf.fill(SpriteCache.COLORKEY)
+        self.paint(LCD(surf), pad, pad, side, flash)
+        surf.set_colorkey(SpriteCache.COLORKEY, pygame.RLEACCEL)
+        r = surf.get_bounding_rect()
+        return surf.subsurface(r).copy(), r.x - pad, r.y - pad
+    def paint(self, lcd, x, y, side, flash):
+        rec = self.rec; shape = rec.shape
+        body_col = rec.col
         if self.armor_name in ARMORS and "Tunic" not in self.armor_name:
              if ARMORS[self.armor_name]['col'] != GREY: body_col = ARMORS[self.armor_name]['col']
-        if self.flash_timer > 0: body_col = WHITE; self.flash_timer -= 1
-        w = int(d['w'] * scale); h = int(d['h'] * scale)
-        if shape == "BEAST": self.draw_beast(lcd, x, y, side, w, h, body_col)
-        elif shape == "FLY": self.draw_fly(lcd, x, y, side, w, h, body_col)
-        elif shape == "BLOB": self.draw_blob(lcd, x, y, side, w, h, body_col)
+        if flash: body_col = WHITE
+        w = rec.w; h = rec.h
+        if shape == SHAPE_BEAST: self.draw_beast(lcd, x, y, side, w, h, body_col)
+        elif shape == SHAPE_FLY: self.draw_fly(lcd, x, y, side, w, h, body_col)
+        elif shape == SHAPE_BLOB: self.draw_blob(lcd, x, y, side, w, h, body_col)
         else: self.draw_human(lcd, x, y, side, w, h, body_col)
     def draw_human(self, lcd, x, y, side, w, h, col):
         lcd.fill_rect(x, y + (h//3), w, h - (h//3), col) 
@@ -540,56 +934,152 @@ class FantasyUnit:
         else:
              lcd.line(wx, hand_y, wx, tip_y, w_col)
 
+class StatusBoard:
+    # One battle's status clock. Walkers keep a flag bit and an (expiry tick, chain) slot per effect;
+    # the board keeps a single min-heap of expirations and periodic ticks, so an active effect costs
+    # nothing until it is due. Refreshing an effect just moves its expiry: the old heap entry no
+    # longer matches the slot and is dropped when popped, so every effect is removed exactly once.
+    def __init__(self): self.tick = 0; self.heap = []; self.seq = 0
+    def push(self, due, w, name, kind, chain):
+        self.seq += 1; heapq.heappush(self.heap, (due, self.seq, w, name, kind, chain))
+    def apply(self, w, name, ticks):
+        bit = STATUS_BITS[name]; due = self.tick + ticks
+        if w.expiry is None: w.expiry = {} # most walkers never get a status, so the dict is made on first use
+        if w.flags & bit: chain = w.expiry[name][1]
+        else:
+            w.flags |= bit; chain = self.seq + 1
+            every = STATUS_EFFECTS[name].get('every')
+            if every: self.push(self.tick + every, w, name, "tick", chain)
+        w.expiry[name] = (due, chain); self.push(due, w, name, "expire", chain)
+    def clear(self, w, name):
+        w.flags &= ~STATUS_BITS[name]
+        if w.expiry: w.expiry.pop(name, None)
+    def advance(self, tick):
+        self.tick = tick; heap = self.heap
+        while heap and heap[0][0] <= tick:
+            due, _, w, name, kind, chain = heapq.heappop(heap)
+            slot = w.expiry.get(name)
+            if slot is None or slot[1] != chain: continue
+            if kind == "expire":
+                if slot[0] == due: self.clear(w, name)
+            elif w.state != "DEAD":
+                effect = STATUS_EFFECTS[name]; effect['tick'](w)
+                if name in w.expiry: self.push(due + effect['every'], w, name, "tick", chain)
+
+class FieldIndex:
+    # Per-side walker lists sorted by x, rebuilt once per tick. Queries use live positions, so
+    # MARGIN must cover the furthest a walker can move during the tick after the rebuild.
+    MARGIN = 8
+    def __init__(self, walkers):
+        entries = {"LEFT": [], "RIGHT": []}
+        for i, w in enumerate(walkers):
+            if w.state != "DEAD": entries[w.side].append((w.x, i, w))
+        self.xs = {}; self.items = {}
+        for side, e in entries.items():
+            e.sort(key=lambda t: t[0])
+            self.xs[side] = [t[0] for t in e]; self.items[side] = [(t[1], t[2]) for t in e]
+    def nearest_enemy(self, me, radius):
+        side = "RIGHT" if me.side == "LEFT" else "LEFT"
+        xs = self.xs[side]; items = self.items[side]
+        best = None; best_i = 0; best_d2 = radius * radius
+        pos = bisect.bisect_left(xs, me.x)
+        for k in range(pos, len(xs)):
+            gap = xs[k] - me.x - self.MARGIN
+            if gap > 0 and gap * gap > best_d2: break
+            i, other = items[k]
+            if other.state == "DEAD": continue
+            dx = me.x - other.x; dy = me.y - other.y; d2 = dx*dx + dy*dy
+            if d2 < best_d2 or (best and d2 == best_d2 and i < best_i): best = other; best_i = i; best_d2 = d2
+        for k in range(pos - 1, -1, -1):
+            gap = me.x - xs[k] - self.MARGIN
+            if gap > 0 and gap * gap > best_d2: break
+            i, other = items[k]
+            if other.state == "DEAD": continue
+            dx = me.x - other.x; dy = me.y - other.y; d2 = dx*dx + dy*dy
+            if d2 < best_d2 or (best and d2 == best_d2 and i < best_i): best = other; best_i = i; best_d2 = d2
+        return best
+    def wounded_ally(self, me, radius):
+        xs = self.xs[me.side]; items = self.items[me.side]; r2 = radius * radius
+        lo = bisect.bisect_left(xs, me.x - radius - self.MARGIN); hi = bisect.bisect_right(xs, me.x + radius + self.MARGIN)
+        best = None; best_i = 0
+        for k in range(lo, hi):
+            i, other = items[k]
+            if best and i > best_i: continue
+            if other.state == "DEAD" or other is me or other.unit.hp >= other.unit.max_hp * 0.7: continue
+            dx = me.x - other.x; dy = me.y - other.y
+            if dx*dx + dy*dy < r2: best = other; best_i = i
+        return best
+
+class SpriteCache:
+    # Units are rasterized once per look (race, gear, facing, staff gem, flash, long weapon) into a
+    # colorkeyed surface trimmed to its bounding box, then blitted. PAD leaves room for weapons
+    # and beast heads that reach past the body box.
+    PAD = 32; COLORKEY = (255, 0, 254)
+    def __init__(self, capacity=None): self.lru = LRUCache(capacity or SPRITE_CACHE_SIZE)
+    def get(self, unit, side, flash):
+        key = (unit.race, unit.armor_name, unit.weapon_name, side, unit.dna > 50, flash, unit.level > 15)
+        s = self.lru.get(key)
+        if s is None: s = self.lru.put(key, unit.rasterize(side, flash))
+        return s
+    def clear(self): self.lru.clear()
+    def stats(self): return self.lru.stats()
+
+SPRITES = SpriteCache()
+
 class Walker:
-    def __init__(self, unit, side):
-        self.unit = unit; self.side = side 
+    __slots__ = ("unit", "side", "state", "target", "attack_cd", "x", "dir", "y", "speed", "anim_offset", "flags", "expiry", "statuses", "field", "rng")
+    def __init__(self, unit, side, rng=random):
+        self.unit = unit; self.side = side; self.rng = rng
         self.state = "WALK"; self.target = None; self.attack_cd = 0
         if side == "LEFT": self.x = -10; self.dir = 1
         else: self.x = 170; self.dir = -1
-        self.y = random.randint(60, 110); self.speed = random.uniform(0.8, 1.5)
-        self.anim_offset = 0; self.status = {} 
+        self.y = rng.randint(60, 110); self.speed = rng.uniform(0.8, 1.5)
+        self.anim_offset = 0; self.flags = 0; self.expiry = None; self.statuses = None; self.field = None
     def draw(self, lcd):
         if self.state == "DEAD": 
             lcd.fill_rect(int(self.x), int(self.y)+8, 10, 4, (50,50,50)); return
         draw_x = int(self.x + (self.anim_offset * self.dir))
-        d = UNIT_DEFS.get(self.unit.race, UNIT_DEFS["Warrior"])
-        w = int(d['w'] * d.get('scale', 1.0))
-        if "SHIELD" in self.status: lcd.rect(draw_x-2, int(self.y)-2, w+4, 12, BLUE)
+        w = self.unit.rec.w
+        if self.flags & ST_SHIELD: lcd.rect(draw_x-2, int(self.y)-2, w+4, 12, BLUE)
         self.unit.draw(lcd, draw_x, int(self.y), self.side)
         el_col = ELEMENTS[self.unit.element]['col']
         lcd.fill_rect(draw_x+2, int(self.y)-3, 4, 2, el_col)
-    def update(self, all_walkers, particle_list, projectile_list):
+    def find_wounded_ally(self, all_walkers, radius):
+        r2 = radius * radius
+        for other in all_walkers:
+            if other.side == self.side and other.state != "DEAD" and other != self:
+                if other.unit.hp < other.unit.max_hp * 0.7:
+                    dx = self.x - other.x; dy = self.y - other.y
+                    if dx*dx + dy*dy < r2: return other
+        return None
+    def find_nearest_enemy(self, all_walkers, radius):
+        closest_d2 = radius * radius; closest_enemy = None
+        for other in all_walkers:
+            if other.side != self.side and other.state != "DEAD":
+                dx = self.x - other.x; dy = self.y - other.y; d2 = dx*dx + dy*dy
+                if d2 < closest_d2: closest_d2 = d2; closest_enemy = other
+        return closest_enemy
+    def update(self, all_walkers, particle_list, projectile_list, field_index=None):
         if self.state == "DEAD": return
-        if self.x < -30 or self.x > 190: self.state = "DEAD"; return
+        if self.x < -30 or self.x > 190: self.die(); return
         current_speed = self.speed
-        if "SPD" in self.status: current_speed *= 1.5
-        if self.status:
-            for k in list(self.status.keys()):
-                self.status[k] -= 1
-                if self.status[k] <= 0: del self.status[k]
-            if "POISON" in self.status and random.randint(0, 30) == 0: self.take_damage(1, False)
+        if self.flags & ST_SPD: current_speed *= 1.5
         
-        d = UNIT_DEFS.get(self.unit.race, UNIT_DEFS["Warrior"])
-        is_necro = self.unit.race in ["Necro", "Lich", "Lich Lord", "Lich King"]
+        is_necro = self.unit.rec.necro
         if self.state == "WALK":
             self.x += current_speed * self.dir
             found_heal = False
-            if is_necro: 
-                for other in all_walkers:
-                    if other.side == self.side and other.state != "DEAD" and other != self:
-                        if other.unit.hp < other.unit.max_hp * 0.7:
-                             if math.sqrt((self.x-other.x)**2 + (self.y-other.y)**2) < 80:
-                                 self.target = other; self.state = "BUFF_MODE"; found_heal = True; break
+            if is_necro:
+                if field_index: other = field_index.wounded_ally(self, 80)
+                else: other = self.find_wounded_ally(all_walkers, 80)
+                if other: self.target = other; self.state = "BUFF_MODE"; found_heal = True
             if not found_heal:
-                closest_dist = 999; closest_enemy = None
-                for other in all_walkers:
-                    if other.side != self.side and other.state != "DEAD":
-                        dist = math.sqrt((self.x-other.x)**2 + (self.y-other.y)**2)
-                        if dist < 120 and dist < closest_dist: closest_dist = dist; closest_enemy = other
+                if field_index: closest_enemy = field_index.nearest_enemy(self, 120)
+                else: closest_enemy = self.find_nearest_enemy(all_walkers, 120)
                 if closest_enemy: self.state = "FIGHT"; self.target = closest_enemy
         if self.state == "FIGHT" or self.state == "BUFF_MODE":
             if self.target is None or self.target.state == "DEAD": self.state = "WALK"; self.target = None; return
-            target_w = UNIT_DEFS.get(self.target.unit.race, {}).get('w', 8) * UNIT_DEFS.get(self.target.unit.race, {}).get('scale', 1.0)
+            target_w = self.target.unit.rec.width
             target_x_edge = self.target.x if self.side == "RIGHT" else (self.target.x + target_w)
             dist = math.sqrt((target_x_edge - self.x)**2 + (self.target.y - self.y)**2)
             req_range = self.unit.range if self.unit.range > 10 else 5 
@@ -603,43 +1093,302 @@ class Walker:
                     if self.state == "BUFF_MODE": 
                         heal = int(self.unit.level * 4) + 5
                         self.target.unit.hp = min(self.target.unit.hp + heal, self.target.unit.max_hp)
-                        particle_list.append(Particle(self.target.x, self.target.y-10, GREEN, "TEXT", f"+{heal}"))
+                        particle_list.emit(self.target.x, self.target.y-10, GREEN, "TEXT", f"+{heal}")
                         self.state = "WALK"
                     else: 
-                        base_dmg = self.unit.get_power()
-                        mult = 1.0 
-                        final_dmg = int(base_dmg * mult); is_crit = (mult > 1.0)
+                        atk = self.unit.stats or self.unit.combat_stats(); dfn = self.target.unit.stats or self.target.unit.combat_stats()
+                        mult = ELEMENT_MULT[atk[2]][dfn[2]]
+                        final_dmg = atk[0] * mult // 100; is_crit = mult > 100
                         if self.unit.range < 20:
                             self.target.take_damage(final_dmg, is_crit)
                             if self.unit.has_lifesteal: self.unit.hp = min(self.unit.hp + 2, self.unit.max_hp)
                         else:
                             projectile_list.append(Projectile(self.x, self.y, self.target, final_dmg, is_crit, self.unit.element))
+    def has_status(self, name): return bool(self.flags & STATUS_BITS[name])
+    def add_status(self, name, ticks):
+        if self.statuses is not None: self.statuses.apply(self, name, ticks)
+        else: self.flags |= STATUS_BITS[name] # no battle clock: nothing would ever expire it
+    def die(self):
+        if self.state == "DEAD": return
+        self.state = "DEAD"
+        if self.field: self.field.died(self)
     def take_damage(self, amount, is_crit):
-        if self.unit.race in ["Ninja", "Ghost", "Bat", "Vampire", "Storm Crow"] and random.random() < 0.30: return 
-        scale = UNIT_DEFS.get(self.unit.race, {}).get('scale', 1.0)
-        mitigation_mult = 1.0
-        if scale >= 1.4: mitigation_mult = 0.75 
-        elif scale >= 1.2: mitigation_mult = 0.90 
-        reduced_damage = int(amount * mitigation_mult)
-        defense = self.unit.get_defense() + (4 if "SHIELD" in self.status else 0)
+        rec = self.unit.rec
+        if rec.dodge and self.rng.random() < 0.30: return 
+        reduced_damage = int(amount * rec.mitigation)
+        defense = (self.unit.stats or self.unit.combat_stats())[1] + (4 if self.flags & ST_SHIELD else 0)
         actual_damage = max(1, reduced_damage - defense)
         self.unit.hp -= actual_damage
         if self.unit.hp <= 0: 
-            self.state = "DEAD"
-            if self.unit.is_fanatic: self.status['EXPLODE_ON_DEATH'] = 1
+            self.die()
+            if self.unit.is_fanatic: self.add_status('EXPLODE_ON_DEATH', 1)
+
+# Binary save: header, a string table every race/name/element/item name is stored in once, the
+# known MACs (only in saves from before NetworkHistory) and beaten levels, then one fixed-width record per unit.
+SAVE_MAGIC = b"WWSB"; SAVE_VERSION = 1
+SAVE_HEADER = struct.Struct("<4sHqIIII") # magic, version, gold, strings, known MACs, beaten levels, units
+UNIT_RECORD = struct.Struct("<6H7i") # race, name, element, weapon, armor, artifact ids; level, xp, hp, max_hp, str, range, dna
+NO_STRING = 0xFFFF
+
+def load_unit(d):
+    u = FantasyUnit(load_data=d)
+    if u.hp <= 0: u.hp = 1
+    if u.hp > u.max_hp: u.hp = u.max_hp
+    return u
+
+class SaveImage:
+    # A parsed binary save. Unit records stay packed in the file buffer until unit(i) is called.
+    def __init__(self, data):
+        magic, version, self.gold, n_str, n_known, n_beaten, self.count = SAVE_HEADER.unpack_from(data)
+        if magic != SAVE_MAGIC: raise ValueError("not a WiFi Warriors save")
+        if version > SAVE_VERSION: raise ValueError(f"save version {version} is newer than this game")
+        pos = SAVE_HEADER.size; self.strings = []
+        for _ in range(n_str):
+            n = int.from_bytes(data[pos:pos+2], "little"); self.strings.append(data[pos+2:pos+2+n].decode("utf-8")); pos += 2 + n
+        self.known = list(struct.unpack_from(f"<{n_known}q", data, pos)); pos += 8 * n_known
+        self.beaten = list(struct.unpack_from(f"<{n_beaten}i", data, pos)); pos += 4 * n_beaten
+        self.records = memoryview(data)[pos:pos + self.count * UNIT_RECORD.size]
+        if len(self.records) != self.count * UNIT_RECORD.size: raise ValueError("truncated save")
+    def unit_data(self, i):
+        race, name, el, wpn, arm, art, lvl, xp, hp, mhp, st, rng, dna = UNIT_RECORD.unpack_from(self.records, i * UNIT_RECORD.size)
+        s = self.strings
+        return {'r': s[race], 'l': lvl, 'x': xp, 'hp': hp, 'mhp': mhp, 's': st, 'n': s[name], 'rng': rng, 'el': s[el],
+                'wpn': s[wpn], 'arm': s[arm], 'art': None if art == NO_STRING else s[art], 'dna': dna}
+    def unit(self, i): return load_unit(self.unit_data(i))
+
+class UnitRoster(MutableSequence):
+    # Army.units after a binary load. A slot holds a FantasyUnit or the index of a still-packed record,
+    # which is built the first time the slot is read. Nothing outside can hold a unit that was never
+    # built, so membership, index() and remove() only compare the built ones.
+    def __init__(self, image): self.image = image; self.slots = list(range(image.count))
+    def __len__(self): return len(self.slots)
+    def __getitem__(self, i):
+        if isinstance(i, slice): return [self[j] for j in range(*i.indices(len(self.slots)))]
+        u = self.slots[i]
+        if type(u) is int: u = self.slots[i] = self.image.unit(u)
+        return u
+    def __setitem__(self, i, u):
+        if isinstance(i, slice): u = list(u)
+        self.slots[i] = u
+    def __delitem__(self, i): del self.slots[i]
+    def insert(self, i, u): self.slots.insert(i, u)
+    def __contains__(self, u): return any(s is u for s in self.slots)
+    def index(self, u, start=0, stop=None):
+        for i in range(start, len(self.slots) if stop is None else stop):
+            if self.slots[i] is u: return i
+        raise ValueError("unit not in roster")
+    def built(self): return sum(1 for s in self.slots if type(s) is not int)
+
+def encode_save(gold, known, beaten, units):
+    # Records of roster slots nobody touched are copied byte for byte: the image's string table is kept
+    # as the prefix of the new one, so their string ids stay valid.
+    image = getattr(units, 'image', None); slots = units.slots[:] if image else list(units)
+    strings = list(image.strings) if image else []; ids = {s: i for i, s in enumerate(strings)}
+    def sid(s):
+        if s is None: return NO_STRING
+        i = ids.get(s)
+        if i is None:
+            i = ids[s] = len(strings); strings.append(s)
+            if i >= NO_STRING: raise ValueError("save string table is full")
+        return i
+    size = UNIT_RECORD.size; recs = bytearray()
+    for u in slots:
+        if type(u) is int: recs += image.records[u * size:(u + 1) * size]
+        else: recs += UNIT_RECORD.pack(sid(u.race), sid(u.name), sid(u.element), sid(u.weapon_name), sid(u.armor_name), sid(u.artifact),
+                                       u.level, u.xp, u.hp, u.max_hp, u.str, u.range, u.dna)
+    out = bytearray(SAVE_HEADER.pack(SAVE_MAGIC, SAVE_VERSION, gold, len(strings), len(known), len(beaten), len(slots)))
+    for s in strings: b = s.encode("utf-8"); out += len(b).to_bytes(2, "little") + b
+    out += struct.pack(f"<{len(known)}q", *known) + struct.pack(f"<{len(beaten)}i", *beaten) + recs
+    return bytes(out)
+
+def convert_save(src, dst):
+    # JSON <-> binary by content of src and extension of dst (".json" writes JSON, anything else binary).
+    with open(src, "rb") as f: data = f.read()
+    if data[:4] == SAVE_MAGIC:
+        image = SaveImage(data)
+        gold, known, beaten = image.gold, image.known, image.beaten; units = [image.unit_data(i) for i in range(image.count)]
+    else:
+        state = json.loads(data); gold = state.get('gold', 100); known = state.get('known', []); beaten = state.get('beaten', [])
+        units = state['units']
+    if dst.endswith(".json"): out = json.dumps({"gold": gold, "known": known, "beaten": beaten, "units": units}).encode("utf-8")
+    else: out = encode_save(gold, known, beaten, [load_unit(d) for d in units])
+    with open(dst, "wb") as f: f.write(out)
+    return len(units)
+
+class SaveManager:
+    # Write-behind saves. Army.save_game only marks the army (O(1), safe mid-battle); the first mark of
+    # a burst sets a deadline. Menus call poll(), which encodes each army whose deadline has passed on
+    # the main thread, so every image is one consistent state, and flush() (scene exits, quit) encodes
+    # whatever is left. A background thread writes the images with a temp file + os.replace, so a
+    # crash mid-write leaves the previous save intact; flush() blocks until all is on disk.
+    def __init__(self, coalesce_ms=SAVE_COALESCE_MS):
+        self.coalesce = coalesce_ms / 1000; self.cond = threading.Condition()
+        self.pending = {} # save path -> (army, deadline); main thread only
+        self.dirty = {} # save path -> (army, image) waiting for the writer
+        self.busy = False; self.thread = None; self.writes = 0; self.snapshots = 0
+    def mark(self, army):
+        old = self.pending.get(army.save_path)
+        self.pending[army.save_path] = (army, old[1] if old else time.monotonic() + self.coalesce)
+    def poll(self):
+        # Hands over every army whose burst is over; returns ms until the next deadline (None: nothing pending).
+        if not self.pending: return None
+        now = time.monotonic(); due = [path for path, (_, deadline) in self.pending.items() if deadline <= now]
+        if due: self.hand(due)
+        return max(1, int((min(d for _, d in self.pending.values()) - now) * 1000) + 1) if self.pending else None
+    def hand(self, paths):
+        images = {}
+        for path in paths: army = self.pending.pop(path)[0]; images[path] = (army, army.snapshot()); self.snapshots += 1
+        with self.cond:
+            self.dirty.update(images); self.cond.notify_all()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="ww-save", daemon=True); self.thread.start()
+    def discard(self, army):
+        self.pending.pop(army.save_path, None)
+        with self.cond:
+            self.dirty.pop(army.save_path, None)
+            while self.busy: self.cond.wait()
+    def flush(self):
+        if self.pending: self.hand(list(self.pending))
+        with self.cond:
+            while self.dirty or self.busy: self.cond.wait()
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.dirty: self.cond.wait()
+                images = list(self.dirty.values()); self.dirty.clear(); self.busy = True
+            try:
+                for army, data in images: army.write_save(data); self.writes += 1
+            finally:
+                with self.cond: self.busy = False; self.cond.notify_all()
+
+SAVES = SaveManager(); atexit.register(SAVES.flush)
+
+class BloomFilter:
+    # Fixed-size Bloom filter over 64-bit ints: no false negatives, about error_rate false positives at capacity.
+    def __init__(self, capacity, error_rate=0.01, bits=None):
+        self.capacity = capacity; self.error_rate = error_rate
+        self.m = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8) if bits is None else bytearray(bits)
+    @staticmethod
+    def mix(x):
+        x = (x + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return x ^ (x >> 31)
+    def positions(self, key):
+        h1 = self.mix(key); h2 = self.mix(h1) | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+    def add(self, key):
+        for p in self.positions(key): self.bits[p >> 3] |= 1 << (p & 7)
+    def __contains__(self, key): return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+
+class NetworkHistory:
+    # Every network a slot has met, keyed by its MAC/seed int: first seen, last seen and fights.
+    # The index is a dict of packed ints (O(1) membership), loaded on first use from an append-only
+    # log of full records where the last one per MAC wins; a torn tail record is cut off and the log
+    # is compacted once it is mostly superseded. With bloom_capacity set, a Bloom filter saved next to
+    # the log answers "never seen" during scans without replaying it. The army save is never touched.
+    RECORD = struct.Struct("<qIIH") # mac, first seen, last seen (unix seconds), fights
+    BLOOM_HEADER = struct.Struct("<QdQ") # log size the filter covers, error rate, capacity
+    def __init__(self, path, bloom_capacity=0):
+        self.path = path; self.bloom_path = path + ".bloom"; self.index = None; self.log = None; self.records = 0; self.bloom_capacity = bloom_capacity
+        self.bloom = self.read_bloom(bloom_capacity) if bloom_capacity else None
+        HISTORIES.add(self)
+    def log_size(self):
+        try: return os.path.getsize(self.path)
+        except OSError: return 0
+    def read_bloom(self, capacity):
+        # A saved filter is only trusted if the log has not grown since it was written.
+        try:
+            with open(self.bloom_path, "rb") as f: data = f.read()
+            covered, rate, cap = self.BLOOM_HEADER.unpack_from(data)
+            if covered == self.log_size() and cap == capacity: return BloomFilter(cap, rate, data[self.BLOOM_HEADER.size:])
+        except (OSError, struct.error): pass
+        return None
+    def load(self):
+        self.index = {}; size = self.RECORD.size
+        try:
+            with open(self.path, "rb") as f: data = f.read()
+        except FileNotFoundError: data = b""
+        tail = len(data) % size
+        if tail: # cut a torn record off the file too, or the next append would start mid-record
+            data = data[:-tail]
+            with open(self.path, "r+b") as f: f.truncate(len(data))
+        self.records = len(data) // size
+        for mac, first, last, fights in self.RECORD.iter_unpack(data): self.index[mac] = (first << 48) | (last << 16) | fights
+        if self.bloom_capacity and self.bloom is None:
+            self.bloom = BloomFilter(self.bloom_capacity)
+            for mac in self.index: self.bloom.add(mac)
+        if self.records > 2 * len(self.index) + 1024: self.compact()
+    def __len__(self):
+        if self.index is None: self.load()
+        return len(self.index)
+    def __contains__(self, mac):
+        if self.index is None:
+            if self.bloom is not None and mac not in self.bloom: return False
+            self.load()
+        return mac in self.index
+    def get(self, mac):
+        if self.index is None: self.load()
+        v = self.index.get(mac)
+        return None if v is None else {"first": v >> 48, "last": (v >> 16) & 0xFFFFFFFF, "fights": v & 0xFFFF}
+    def record_many(self, macs, fought=False, when=None):
+        # A batch the Bloom filter has never seen only needs appending: the log is not replayed for it.
+        macs = list(macs)
+        if self.index is None and (self.bloom is None or any(mac in self.bloom for mac in macs)): self.load()
+        index = {} if self.index is None else self.index
+        when = int(time.time() if when is None else when); out = bytearray()
+        for mac in macs:
+            v = index.get(mac)
+            first = when if v is None else v >> 48; fights = min((0 if v is None else v & 0xFFFF) + (1 if fought else 0), 0xFFFF)
+            index[mac] = (first << 48) | (when << 16) | fights
+            if self.bloom is not None: self.bloom.add(mac)
+            out += self.RECORD.pack(mac, first, when, fights)
+        if not out: return
+        if self.log is None: self.log = open(self.path, "ab")
+        self.log.write(out); self.log.flush(); self.records += len(out) // self.RECORD.size
+    def record(self, mac, fought=False, when=None): self.record_many((mac,), fought, when)
+    def compact(self):
+        self.close(); tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"".join(self.RECORD.pack(mac, v >> 48, (v >> 16) & 0xFFFFFFFF, v & 0xFFFF) for mac, v in self.index.items()))
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.path); self.records = len(self.index); self.close()
+    def clear(self):
+        if self.log: self.log.close(); self.log = None
+        self.index = {}; self.records = 0
+        if self.bloom is not None: self.bloom = BloomFilter(self.bloom.capacity, self.bloom.error_rate)
+        for path in (self.path, self.bloom_path):
+            try: os.remove(path)
+            except FileNotFoundError: pass
+    def close(self):
+        appended = self.log is not None
+        if self.log: self.log.close(); self.log = None
+        if self.bloom is not None and (appended or self.index is not None):
+            with open(self.bloom_path, "wb") as f:
+                f.write(self.BLOOM_HEADER.pack(self.log_size(), self.bloom.error_rate, self.bloom.capacity) + self.bloom.bits)
+
+HISTORIES = weakref.WeakSet() # open histories; closed together at exit without keeping any alive
+def close_histories():
+    for h in list(HISTORIES): h.close()
+atexit.register(close_histories)
 
 class Army:
     def __init__(self, slot_id=1):
-        self.slot_id = slot_id; self.units = []; self.gold = 100; self.known_macs = []; self.beaten_levels = []
-        self.save_path = f"save_{self.slot_id}.json"
+        self.slot_id = slot_id; self.units = []; self.gold = 100; self.beaten_levels = []
+        self.save_path = f"save_{self.slot_id}.wws"; self.legacy_path = f"save_{self.slot_id}.json"
+        self.history = NetworkHistory(f"history_{self.slot_id}.log", HISTORY_BLOOM_CAPACITY)
         self.load_game()
     def create_new_game(self, hero_name, hero_class):
-        self.units = []; self.gold = 100; self.known_macs = []
+        self.units = []; self.gold = 100; self.history.clear()
         hero = FantasyUnit(manual_type=hero_class); hero.name = hero_name; hero.max_hp += 20; hero.hp = hero.max_hp; hero.str += 2
         self.units.append(hero); self.save_game()
     def delete_save(self):
-        try: os.remove(self.save_path); self.units = []
-        except: pass
+        SAVES.discard(self); self.units = []; self.history.clear()
+        for path in (self.save_path, self.legacy_path):
+            try: os.remove(path)
+            except: pass
     def add_recruit(self, u): self.units.append(u); self.save_game()
     def remove_casualties_batch(self, dead_list):
         changed = False
@@ -652,143 +1401,208 @@ class Army:
                 changed = True
         if changed: self.save_game()
     def remove_dead(self, u): self.remove_casualties_batch([u])
-    def remember_mac(self, mac_int):
-        if mac_int not in self.known_macs: self.known_macs.append(mac_int)
-        if len(self.known_macs) > 50: self.known_macs.pop(0)
-        self.save_game()
-    def save_game(self):
+    def remember_mac(self, mac_int): self.history.record(mac_int, fought=True)
+    def import_known(self, macs):
+        # Saves from before NetworkHistory kept the last 50 fought MACs inline; move them to the log once.
+        self.history.record_many([m for m in macs if m not in self.history], fought=True, when=0)
+    def save_game(self): SAVES.mark(self)
+    def snapshot(self): return encode_save(self.gold, (), self.beaten_levels[:], self.units)
+    def write_save(self, data):
+        tmp = self.save_path + ".tmp"
         try:
-            state = {"gold": self.gold, "known": self.known_macs, "beaten": self.beaten_levels, "units": [u.to_dict() for u in self.units]}
-            with open(self.save_path, "w") as f: json.dump(state, f)
+            with open(tmp, "wb") as f: f.write(data); f.flush(); os.fsync(f.fileno())
+            os.replace(tmp, self.save_path)
         except Exception as e: print(e)
     def load_game(self):
+        SAVES.flush()
         try:
-            with open(self.save_path, "r") as f:
-                state = json.load(f); self.gold = state.get('gold', 100); self.known_macs = state.get('known', []); self.beaten_levels = state.get('beaten', [])
-                for d in state['units']: 
-                    u = FantasyUnit(load_data=d)
-                    if u.hp <= 0: u.hp = 1
-                    if u.hp > u.max_hp: u.hp = u.max_hp
-                    self.units.append(u)
+            if os.path.exists(self.save_path):
+                with open(self.save_path, "rb") as f: image = SaveImage(f.read())
+                self.gold = image.gold; self.beaten_levels = image.beaten; self.units = UnitRoster(image)
+                if image.known: self.import_known(image.known); self.save_game()
+                return
+            with open(self.legacy_path, "r") as f:
+                state = json.load(f); self.gold = state.get('gold', 100); self.beaten_levels = state.get('beaten', [])
+                for d in state['units']: self.units.append(load_unit(d))
+            self.import_known(state.get('known', []))
+            self.save_game() # old JSON slot: the next write migrates it to the binary format
         except: pass
 
 # --- 5. SYSTEM FUNCTIONS ---
 def spawn_spell_fx(x, y, color, style, particle_list):
+    rng = particle_list.rng
     if style == "METEOR":
         for i in range(5):
-            start_x = x + random.randint(-10, 10); start_y = y - random.randint(30, 50)
+            start_x = x + rng.randint(-10, 10); start_y = y - rng.randint(30, 50)
             vx = (x - start_x) / 10; vy = (y - start_y) / 10
-            particle_list.append(Particle(start_x, start_y, color, "PIXEL", vx=vx, vy=vy, grav=0))
+            particle_list.emit(start_x, start_y, color, "PIXEL", vx=vx, vy=vy, grav=0)
     elif style == "BEAM":
         for i in range(0, int(y), 2):
-            offset = random.randint(-2, 2)
-            particle_list.append(Particle(x + offset, i, color, "PIXEL", vx=0, vy=0, grav=0))
+            offset = rng.randint(-2, 2)
+            particle_list.emit(x + offset, i, color, "PIXEL", vx=0, vy=0, grav=0)
         spawn_spell_fx(x, y, color, "EXPLOSION", particle_list)
     elif style == "NOVA":
         for _ in range(6):
-            vx = random.uniform(-0.5, 0.5); vy = random.uniform(-1, -2.5) 
-            particle_list.append(Particle(x, y, color, "PIXEL", vx=vx, vy=vy, grav=-0.05))
+            vx = rng.uniform(-0.5, 0.5); vy = rng.uniform(-1, -2.5) 
+            particle_list.emit(x, y, color, "PIXEL", vx=vx, vy=vy, grav=-0.05)
     elif style == "EXPLOSION":
         for _ in range(8):
-            vx = random.uniform(-2, 2); vy = random.uniform(-3, 1)
-            particle_list.append(Particle(x, y, color, "PIXEL", vx=vx, vy=vy))
+            vx = rng.uniform(-2, 2); vy = rng.uniform(-3, 1)
+            particle_list.emit(x, y, color, "PIXEL", vx=vx, vy=vy)
     elif style == "POOF":
         for _ in range(12):
-            vx = random.uniform(-1, 1); vy = random.uniform(-1, 1)
-            particle_list.append(Particle(x, y, GREY, "PIXEL", vx=vx, vy=vy, grav=0))
-
-def check_field_events(active_walkers, particle_list, spell_timers, army, log_list, lcd, active_channels):
-    CHANNEL_DURATION = 40 
-    for side in ["LEFT", "RIGHT"]:
-        units = [w for w in active_walkers if w.side == side and w.state != "DEAD"]
-        counts = {}
-        for w in units: r = w.unit.race; counts[r] = counts.get(r, 0) + 1
-        
-        for r in RECIPES:
-            if side == "RIGHT" and r.get('type') != "FUSION": continue
-            cond_met = True
-            for u_type, count in r['req'].items():
-                if counts.get(u_type, 0) < count: cond_met = False; break
-            
-            base_id = r.get('spawn') or r.get('name')
-            recipe_id = f"{side}_{base_id}"
-            
-            if not cond_met:
-                if recipe_id in active_channels: del active_channels[recipe_id]
-                continue
-            
+            vx = rng.uniform(-1, 1); vy = rng.uniform(-1, 1)
+            particle_list.emit(x, y, GREY, "PIXEL", vx=vx, vy=vy, grav=0)
+
+class FieldEvents:
+    # Incremental recipe matcher that replaced the per-tick RECIPES scan. Each side keeps live race
+    # counts, touched only when a walker spawns or dies, and each recipe a count of unmet requirements
+    # reached through a race -> recipes index. A tick visits only recipes that are met, hold a ritual
+    # channel or have a spell coming off cooldown. Cooldowns only run while their recipe is met, so a
+    # spell that drops out keeps its remaining ticks; running cooldowns are due ticks. Channels are
+    # visited every tick anyway and keep the old countdown, one tick off per met recipe holding them.
+    CHANNEL_DURATION = 40
+    def __init__(self, army, log_list, statuses=None, recipes=None, rng=random):
+        self.army = army; self.log = log_list; self.statuses = statuses; self.recipes = RECIPES if recipes is None else recipes; self.rng = rng
+        self.by_race = {}; self.spells = set(); self.holders = {}
+        for i, r in enumerate(self.recipes):
+            if r.get('type') == "SPELL": self.spells.add(i)
+            for race, need in r['req'].items(): self.by_race.setdefault(race, []).append((i, need))
+        # Channels are keyed like the old recipe_id, so family fusions (no spawn, no name) share one slot
+        # and each met family recipe takes a tick off it, as before.
+        self.ids = {side: [f"{side}_{r.get('spawn') or r.get('name')}" for r in self.recipes] for side in ("LEFT", "RIGHT")}
+        for ids in self.ids.values():
+            for i, rid in enumerate(ids): self.holders.setdefault(rid, []).append(i)
+        self.counts = {"LEFT": {}, "RIGHT": {}}; self.channels = {"LEFT": {}, "RIGHT": {}}
+        self.missing = {side: [len(r['req']) for r in self.recipes] for side in ("LEFT", "RIGHT")}
+        self.met = {side: {i for i, n in enumerate(self.missing[side]) if n == 0} for side in ("LEFT", "RIGHT")}
+        self.paused = {} # spell recipe -> cooldown ticks left while its requirements are unmet
+        self.due = {} # running spell recipe -> tick it casts next
+        self.schedule = {} # tick -> spell recipes due that tick (stale entries are skipped)
+        self.flipped = self.spells & self.met["LEFT"]; self.tick = 0
+    def spawn(self, w): w.field = self; w.statuses = self.statuses; self.count(w, 1)
+    def died(self, w): self.count(w, -1)
+    def count(self, w, delta):
+        side = w.side; counts = self.counts[side]; race = w.unit.race
+        before = counts.get(race, 0); after = before + delta; counts[race] = after
+        missing = self.missing[side]; met = self.met[side]
+        for i, need in self.by_race.get(race, ()):
+            if before < need <= after: missing[i] -= 1
+            elif after < need <= before: missing[i] += 1
+            else: continue
+            if missing[i] == 0: met.add(i)
+            else: met.discard(i)
+            if side == "LEFT" and i in self.spells: self.flipped.add(i)
+    def plan(self, i, tick): self.due[i] = tick; self.schedule.setdefault(tick, []).append(i)
+    def process(self, active_walkers, particle_list):
+        t = self.tick; self.tick += 1
+        met = self.met["LEFT"]
+        for i in self.flipped:
+            if i in met and i not in self.due: self.plan(i, t + self.paused.pop(i, 0))
+            elif i not in met and i in self.due: self.paused[i] = self.due.pop(i) - t
+        self.flipped.clear()
+        due_now = {i for i in self.schedule.pop(t, ()) if self.due.get(i) == t}
+        for side in ("LEFT", "RIGHT"):
+            if self.process_side(side, t, active_walkers, particle_list, due_now if side == "LEFT" else ()): return
+    def process_side(self, side, t, active_walkers, particle_list, due_spells):
+        met = set(self.met[side]); channels = self.channels[side]; ids = self.ids[side]
+        todo = {i for i in met if self.recipes[i].get('type') == "FUSION"}; todo.update(due_spells)
+        for rid in channels: todo.update(self.holders[rid])
+        if not todo: return False
+        n = len(active_walkers); units = None; queue = sorted(todo)
+        while queue:
+            i = heapq.heappop(queue); r = self.recipes[i]; recipe_id = ids[i]
+            if i not in met: channels.pop(recipe_id, None); continue
+            if units is None: units = [w for w in active_walkers[:n] if w.side == side and w.state != "DEAD"]
             if r.get('type') == "FUSION":
-                if recipe_id in active_channels:
-                    channel_data = active_channels[recipe_id]
+                channel_data = channels.get(recipe_id)
+                if channel_data:
                     target = channel_data['target']
-                    if target.state == "DEAD" or target not in active_walkers: del active_channels[recipe_id]; continue
+                    if target.state == "DEAD": del channels[recipe_id]; continue
                     chan_col = YELLOW if side == "LEFT" else MAGENTA
                     spawn_spell_fx(target.x, target.y - 15, chan_col, "PIXEL", particle_list)
                     channel_data['timer'] -= 1
-                    if channel_data['timer'] <= 0:
-                        spawn_name = r.get('spawn')
-                        if 'family' in r: spawn_name = "Earth Golem" 
-                        if spawn_name:
-                            if side == "LEFT": log_list.append(f"Fused: {spawn_name}")
-                            spawn_spell_fx(target.x, target.y, GREY, "POOF", particle_list)
-                            lvl_boost = 2 if side == "LEFT" else 5 
-                            new_u = FantasyUnit(manual_type=spawn_name, level_scale=target.unit.level+lvl_boost)
-                            if side == "LEFT": army.add_recruit(new_u) 
-                            new_w = Walker(new_u, side)
-                            if side == "LEFT": new_w.x = -15; new_w.dir = 1
-                            else: new_w.x = 175; new_w.dir = -1
-                            new_w.y = target.y 
-                            active_walkers.append(new_w)
-                            to_kill = r['req'].copy()
-                            for w in units:
-                                if w.unit.race in to_kill and to_kill[w.unit.race] > 0:
-                                    w.state = "DEAD"; w.x = -999; to_kill[w.unit.race] -= 1
-                            del active_channels[recipe_id]; return 
+                    if channel_data['timer'] <= 0 and self.fuse(r, side, target, units, active_walkers, particle_list):
+                        del channels[recipe_id]; self.skip_rest(side, i, t); return True
                 else:
                     sac_target = None
                     for w in units:
                         if w.unit.race == r['sac']: sac_target = w; break
                     if sac_target:
-                        active_channels[recipe_id] = {'timer': CHANNEL_DURATION, 'target': sac_target}
+                        channels[recipe_id] = {'timer': self.CHANNEL_DURATION, 'target': sac_target}
+                        for j in self.holders[recipe_id]: # later recipes sharing the slot see it this tick
+                            if j > i and j not in todo: todo.add(j); heapq.heappush(queue, j)
                         txt = "RITUAL!" if side == "LEFT" else "WARNING!"
                         col = YELLOW if side == "LEFT" else RED
-                        particle_list.append(Particle(sac_target.x, sac_target.y-25, col, "TEXT", txt, vy=-0.5))
-            elif r.get('type') == "SPELL" and side == "LEFT":
-                 s_name = r['name']
-                 if s_name not in spell_timers: spell_timers[s_name] = 0
-                 if spell_timers[s_name] > 0: spell_timers[s_name] -= 1
-                 else:
-                     log_list.append(f"Cast: {s_name}")
-                     spell_timers[s_name] = r['cd']
-                     particle_list.append(Particle(80, 40, r['fx'], "TEXT", f"{s_name}!"))
-                     if "dmg" in r:
-                         target_side = "RIGHT"
-                         enemies = [w for w in active_walkers if w.side == target_side and w.state != "DEAD"]
-                         if enemies:
-                             if r.get("aoe"):
-                                 for target in enemies:
-                                     target.take_damage(r['dmg'], True)
-                                     spawn_spell_fx(target.x, target.y, r['fx'], "METEOR", particle_list)
-                             else:
-                                 for _ in range(3):
-                                     target = random.choice(enemies)
-                                     target.take_damage(r['dmg'], True)
-                                     spawn_spell_fx(target.x, target.y, r['fx'], "EXPLOSION", particle_list)
-                     elif "heal" in r:
-                         for w in units:
-                             heal_val = r['heal'] + (w.unit.max_hp // 10)
-                             w.unit.hp = min(w.unit.max_hp, w.unit.hp + heal_val)
-                             spawn_spell_fx(w.x, w.y, r['fx'], "NOVA", particle_list)
-                     elif "buff" in r:
-                         buff_type = r['buff']
-                         for w in units: w.status[buff_type] = 300
-                         spawn_spell_fx(w.x, w.y, r['fx'], "NOVA", particle_list)
-                     elif "summon" in r:
-                         u_type = r['summon']
-                         new_u = FantasyUnit(manual_type=u_type, level_scale=army.units[0].level)
-                         new_w = Walker(new_u, side)
-                         new_w.x = -10; new_w.y = random.randint(60, 100)
-                         active_walkers.append(new_w)
+                        particle_list.emit(sac_target.x, sac_target.y-25, col, "TEXT", txt, vy=-0.5)
+            elif side == "LEFT": self.cast(i, r, t, units, active_walkers, particle_list)
+        return False
+    def skip_rest(self, side, i, t):
+        # A fusion ends the tick the way the old scan's return did. Channels it skips simply are not
+        # counted down; player spells after it lose this tick, so their due ticks slide by one.
+        if side == "LEFT":
+            for j in list(self.due):
+                if j > i: self.plan(j, self.due[j] + 1)
+    def fuse(self, r, side, target, units, active_walkers, particle_list):
+        spawn_name = r.get('spawn')
+        if 'family' in r: spawn_name = "Earth Golem" 
+        if not spawn_name: return False
+        if side == "LEFT": self.log.append(f"Fused: {spawn_name}")
+        spawn_spell_fx(target.x, target.y, GREY, "POOF", particle_list)
+        lvl_boost = 2 if side == "LEFT" else 5 
+        new_u = FantasyUnit(manual_type=spawn_name, level_scale=target.unit.level+lvl_boost, rng=self.rng)
+        if side == "LEFT": self.army.add_recruit(new_u) 
+        new_w = Walker(new_u, side, self.rng)
+        if side == "LEFT": new_w.x = -15; new_w.dir = 1
+        else: new_w.x = 175; new_w.dir = -1
+        new_w.y = target.y 
+        active_walkers.append(new_w); self.spawn(new_w)
+        to_kill = r['req'].copy()
+        for w in units:
+            if w.unit.race in to_kill and to_kill[w.unit.race] > 0:
+                w.die(); w.x = -999; to_kill[w.unit.race] -= 1
+        return True
+    def cast(self, i, r, t, units, active_walkers, particle_list):
+        s_name = r['name']; side = "LEFT"
+        self.log.append(f"Cast: {s_name}")
+        self.plan(i, t + r['cd'] + 1)
+        particle_list.emit(80, 40, r['fx'], "TEXT", f"{s_name}!")
+        if "dmg" in r:
+            target_side = "RIGHT"
+            enemies = [w for w in active_walkers if w.side == target_side and w.state != "DEAD"]
+            if enemies:
+                if r.get("aoe"):
+                    for target in enemies:
+                        target.take_damage(r['dmg'], True)
+                        spawn_spell_fx(target.x, target.y, r['fx'], "METEOR", particle_list)
+                else:
+                    for _ in range(3):
+                        target = self.rng.choice(enemies)
+                        target.take_damage(r['dmg'], True)
+                        spawn_spell_fx(target.x, target.y, r['fx'], "EXPLOSION", particle_list)
+        elif "heal" in r:
+            for w in units:
+                heal_val = r['heal'] + (w.unit.max_hp // 10)
+                w.unit.hp = min(w.unit.max_hp, w.unit.hp + heal_val)
+                spawn_spell_fx(w.x, w.y, r['fx'], "NOVA", particle_list)
+        elif "buff" in r:
+            buff_type = r['buff']
+            for w in units: w.add_status(buff_type, 300)
+            spawn_spell_fx(w.x, w.y, r['fx'], "NOVA", particle_list)
+        elif "summon" in r:
+            u_type = r['summon']
+            new_u = FantasyUnit(manual_type=u_type, level_scale=self.army.units[0].level, rng=self.rng)
+            new_w = Walker(new_u, side, self.rng)
+            new_w.x = -10; new_w.y = self.rng.randint(60, 100)
+            active_walkers.append(new_w); self.spawn(new_w)
+
+def menu_frame(lcd, input_sys, blink_ms=None):
+    # Menus are event driven: present the frame just drawn, then block until input (or the next
+    # blink) so an idle menu costs no CPU. Callers redraw only after this returns.
+    # Pending saves are encoded here, and a live menu wakes up in time for the next one.
+    lcd.show(); due_ms = SAVES.poll()
+    if due_ms is not None and input_sys.realtime: blink_ms = due_ms if blink_ms is None else min(blink_ms, due_ms)
+    return input_sys.wait_for_input(blink_ms)
 
 def cascade_equip(army, new_item_name, lcd):
     current_item = new_item_name
@@ -801,23 +1615,409 @@ def cascade_equip(army, new_item_name, lcd):
             old_item = u.artifact; u.artifact = current_item; current_item = old_item 
     lcd.text("Army Full!", 20, 60, WHITE); army.gold += 100
 def cascade_gear(army, new_gear_name, gear_type):
-    current_gear = new_gear_name
-    target_db = WEAPONS if gear_type == "weapon" else ARMORS
+    current_gear = new_gear_name; kind = "weapon" if gear_type == "weapon" else "armor"
     for u in army.units:
-        item_stats = target_db.get(current_gear)
-        if not item_stats: return 
-        allowed = item_stats.get('classes', [])
-        if allowed and u.race not in allowed: continue 
-        if gear_type == "weapon": old_gear = u.weapon_name; u.weapon_name = current_gear
+        if current_gear not in EQUIPMENT.tables[kind]: return 
+        if not EQUIPMENT.usable(kind, current_gear, u.race): continue 
+        if kind == "weapon": old_gear = u.weapon_name; u.weapon_name = current_gear
         else: old_gear = u.armor_name; u.armor_name = current_gear
         current_gear = old_gear
-        if current_gear in ["Cloth Tunic", "Tattered Robe", "Training Sword", "Old Stick", "Wood Axe"]: return
+        if current_gear in STARTER_GEAR: return
+
+# --- 6. BATTLE ENGINE ---
+# Engines own all battle rules and never draw; the run_* modes only render their state.
+class BattleResult:
+    def __init__(self, win, ticks, casualties, log):
+        self.win = win; self.winner = "LEFT" if win else "RIGHT"
+        self.ticks = ticks; self.casualties = casualties; self.log = log
+
+class SiegeEngine:
+    # Every draw a battle makes (enemy rolls, spawns, dodges, spells, particles) comes from its own
+    # random.Random(seed), handed to its walkers, field events and particle pool; the module stream is
+    # never touched, so nothing outside the battle can shift it.
+    def __init__(self, army, dungeon_data, seed=None, max_on_field=None, enemy_count=10):
+        self.rng = random.Random(seed)
+        self.army = army; self.dungeon = dungeon_data
+        self.max_on_field = max_on_field or MAX_ON_FIELD
+        self.player_reserve = army.units[:]
+        enemy_lvl = int(dungeon_data['lvl'])
+        self.enemy_reserve = [FantasyUnit(level_scale=enemy_lvl, rng=self.rng) for _ in range(enemy_count)]
+        self.walkers = []; self.dead_player_units = []; self.particles = ParticlePool(rng=self.rng); self.projectiles = []
+        self.log = []; self.statuses = StatusBoard(); self.events = FieldEvents(army, self.log, self.statuses, rng=self.rng)
+        self.p_on_field = []; self.e_on_field = []
+        self.game_over = False; self.win = False; self.tick = 0
+    def step(self):
+        self.statuses.advance(self.tick)
+        self.p_on_field = [w for w in self.walkers if w.side == "LEFT" and w.state != "DEAD"]
+        self.e_on_field = [w for w in self.walkers if w.side == "RIGHT" and w.state != "DEAD"]
+        if len(self.p_on_field) < self.max_on_field and len(self.player_reserve) > 0: self.deploy(Walker(self.player_reserve.pop(0), "LEFT", self.rng))
+        if len(self.e_on_field) < self.max_on_field and len(self.enemy_reserve) > 0: self.deploy(Walker(self.enemy_reserve.pop(0), "RIGHT", self.rng))
+
+        if len(self.p_on_field) == 0 and len(self.player_reserve) == 0: self.game_over = True; self.win = False
+        elif len(self.e_on_field) == 0 and len(self.enemy_reserve) == 0: self.game_over = True; self.win = True
+
+        self.events.process(self.walkers, self.particles)
+
+        next_walkers = []; field_index = FieldIndex(self.walkers)
+        for w in self.walkers:
+            w.update(self.walkers, self.particles, self.projectiles, field_index)
+            if w.state == "DEAD":
+                if w.side == "LEFT" and w.unit not in self.dead_player_units: self.dead_player_units.append(w.unit)
+            else: next_walkers.append(w)
+        self.walkers = next_walkers
+        self.particles.update(); self.update_projectiles()
+        self.walkers.sort(key=lambda w: w.y) # draw order is also next tick's update order
+        self.tick += 1
+        return not self.game_over
+    def deploy(self, w): self.walkers.append(w); self.events.spawn(w)
+    def update_projectiles(self): self.projectiles = [p for p in self.projectiles if p.update(self.particles)]
+    def run(self, max_ticks=None):
+        while not self.game_over and (max_ticks is None or self.tick < max_ticks): self.step()
+        return self.result()
+    def remaining(self): return len(self.player_reserve) + len(self.p_on_field), len(self.enemy_reserve) + len(self.e_on_field)
+    def result(self): return BattleResult(self.win, self.tick, self.dead_player_units[:], self.log[:])
+
+class ArraySiegeEngine:
+    # Struct-of-arrays siege core for huge armies. Covers movement, targeting, cooldowns and
+    # melee/ranged hits; fusions, spells, necro heals and status effects stay object-path only.
+    # Walker/FantasyUnit objects are written back by sync() and at the end of the battle.
+    WALK, FIGHT = 0, 1
+    CHUNK = 512 # rows per distance matrix block during target acquisition
+    def __init__(self, army, dungeon_data, seed=None, max_on_field=None, enemy_count=10):
+        if np is None: raise RuntimeError("ArraySiegeEngine needs numpy")
+        self.rng = random.Random(seed) # unit rolls and spawns, as in SiegeEngine; hits draw from np_rng
+        self.army = army; self.dungeon = dungeon_data
+        self.max_on_field = max_on_field or MAX_ON_FIELD
+        self.player_reserve = army.units[:]
+        enemy_lvl = int(dungeon_data['lvl'])
+        self.enemy_reserve = [FantasyUnit(level_scale=enemy_lvl, rng=self.rng) for _ in range(enemy_count)]
+        self.np_rng = np.random.default_rng(seed)
+        n = len(self.player_reserve) + len(self.enemy_reserve)
+        self.x = np.zeros(n); self.y = np.zeros(n); self.speed = np.zeros(n); self.dir = np.zeros(n)
+        self.hp = np.zeros(n, np.int64); self.power = np.zeros(n, np.int64); self.defense = np.zeros(n, np.int64)
+        self.range = np.zeros(n); self.width = np.zeros(n); self.mitigation = np.ones(n)
+        self.cd = np.zeros(n, np.int32); self.target = np.full(n, -1, np.int64); self.state = np.zeros(n, np.int8)
+        self.left = np.zeros(n, bool); self.alive = np.zeros(n, bool); self.dodge = np.zeros(n, bool)
+        self.element = np.zeros(n, np.intp); self.mult = np.array(ELEMENT_MULT, np.int64)
+        self.slots = []; self.pending = {}; self.dead_player_units = []; self.log = []
+        self.particles = ParticlePool(1); self.projectiles = () # nothing is emitted; kept for the renderer and profiler
+        self.p_count = 0; self.e_count = 0
+        self.game_over = False; self.win = False; self.tick = 0
+    def spawn(self, unit, side):
+        w = Walker(unit, side, self.rng); i = len(self.slots); self.slots.append(w)
+        rec = unit.rec
+        self.x[i] = w.x; self.y[i] = w.y; self.speed[i] = w.speed; self.dir[i] = w.dir
+        self.hp[i] = unit.hp; self.power[i], self.defense[i], self.element[i] = unit.combat_stats()
+        self.range[i] = unit.range; self.width[i] = rec.width
+        self.mitigation[i] = rec.mitigation; self.dodge[i] = rec.dodge
+        self.left[i] = side == "LEFT"; self.alive[i] = True
+    def kill(self, idx):
+        idx = idx[self.alive[idx]]
+        self.alive[idx] = False
+        for i in idx[self.left[idx]]: self.dead_player_units.append(self.slots[i].unit)
+    def damage(self, tgt, amount):
+        if len(tgt) == 0: return
+        keep = ~(self.dodge[tgt] & (self.np_rng.random(len(tgt)) < 0.30))
+        tgt = tgt[keep]; amount = amount[keep]
+        reduced = (amount * self.mitigation[tgt]).astype(np.int64)
+        np.subtract.at(self.hp, tgt, np.maximum(1, reduced - self.defense[tgt]))
+        self.kill(np.unique(tgt[self.hp[tgt] <= 0]))
+    def acquire(self, rows, left_side):
+        enemies = np.flatnonzero(self.alive & (self.left != left_side))
+        if len(rows) == 0 or len(enemies) == 0: return
+        ex = self.x[enemies]; ey = self.y[enemies]
+        for k in range(0, len(rows), self.CHUNK):
+            r = rows[k:k + self.CHUNK]
+            d2 = (self.x[r, None] - ex) ** 2 + (self.y[r, None] - ey) ** 2
+            best = d2.argmin(axis=1); hit = d2[np.arange(len(r)), best] < 120 * 120
+            self.target[r[hit]] = enemies[best[hit]]; self.state[r[hit]] = self.FIGHT
+    def step(self):
+        self.p_count = int(np.count_nonzero(self.alive & self.left)); self.e_count = int(np.count_nonzero(self.alive & ~self.left))
+        if self.p_count < self.max_on_field and len(self.player_reserve) > 0: self.spawn(self.player_reserve.pop(0), "LEFT")
+        if self.e_count < self.max_on_field and len(self.enemy_reserve) > 0: self.spawn(self.enemy_reserve.pop(0), "RIGHT")
+        if self.p_count == 0 and len(self.player_reserve) == 0: self.game_over = True; self.win = False
+        elif self.e_count == 0 and len(self.enemy_reserve) == 0: self.game_over = True; self.win = True
+
+        self.kill(np.flatnonzero(self.alive & ((self.x < -30) | (self.x > 190))))
+        act = np.flatnonzero(self.alive)
+        walk = act[self.state[act] == self.WALK]
+        self.x[walk] += self.speed[walk] * self.dir[walk]
+        self.acquire(walk[self.left[walk]], True); self.acquire(walk[~self.left[walk]], False)
+
+        fight = act[self.state[act] == self.FIGHT]
+        lost = ~self.alive[self.target[fight]]
+        self.state[fight[lost]] = self.WALK; self.target[fight[lost]] = -1; fight = fight[~lost]
+        tgt = self.target[fight]
+        edge = self.x[tgt] + np.where(self.left[fight], self.width[tgt], 0)
+        dx = edge - self.x[fight]; dy = self.y[tgt] - self.y[fight]; dist = np.sqrt(dx * dx + dy * dy)
+        far = dist > np.where(self.range[fight] > 10, self.range[fight], 5)
+        mv = fight[far]; step = self.speed[mv] / dist[far]
+        self.x[mv] += dx[far] * step; self.y[mv] += dy[far] * step
+        near = fight[~far]; self.cd[near] += 1
+        fire = self.cd[near] > 20; shooters = near[fire]; self.cd[shooters] = 0
+        melee = self.range[shooters] < 20; aimed = self.target[shooters]
+        hits = self.power[shooters] * self.mult[self.element[shooters], self.element[aimed]] // 100
+        self.damage(aimed[melee], hits[melee])
+        ranged = shooters[~melee]; ranged_hits = hits[~melee]
+        if len(ranged):
+            flight = np.maximum(1, np.ceil((dist[~far][fire][~melee] - 6) / 4)).astype(np.int64)
+            for t in np.unique(flight):
+                sel = flight == t
+                self.pending.setdefault(self.tick + int(t), []).append((self.target[ranged[sel]], ranged_hits[sel]))
+        for tgt, amount in self.pending.pop(self.tick, []): self.damage(tgt, amount)
+        self.tick += 1
+        return not self.game_over
+    def sync(self):
+        for i, w in enumerate(self.slots):
+            w.x = float(self.x[i]); w.y = float(self.y[i]); w.unit.hp = int(self.hp[i])
+            if not self.alive[i]: w.state = "DEAD"; w.target = None
+            elif self.state[i] == self.FIGHT: w.state = "FIGHT"; w.target = self.slots[self.target[i]]
+            else: w.state = "WALK"; w.target = None
+    @property
+    def walkers(self):
+        self.sync(); return sorted((w for w in self.slots if w.state != "DEAD"), key=lambda w: w.y)
+    def run(self, max_ticks=None):
+        while not self.game_over and (max_ticks is None or self.tick < max_ticks): self.step()
+        return self.result()
+    def remaining(self): return len(self.player_reserve) + self.p_count, len(self.enemy_reserve) + self.e_count
+    def result(self):
+        self.sync(); return BattleResult(self.win, self.tick, self.dead_player_units[:], self.log[:])
+
+def make_siege_engine(army, dungeon_data, seed=None, max_on_field=None, enemy_count=10, core=None):
+    cls = ArraySiegeEngine if (core or SIEGE_CORE) == "array" else SiegeEngine
+    return cls(army, dungeon_data, seed, max_on_field, enemy_count)
+
+class FixedStepLoop:
+    # Spends elapsed wall time, scaled by the fast-forward factor, in whole 1/SIM_HZ ticks so the
+    # battle runs at the same speed however fast frames render. Frames that fall behind run several
+    # ticks before the next draw; past MAX_STEPS_PER_FRAME the backlog is dropped rather than chased.
+    # Without a real-time input source every frame is worth exactly one tick of time at 1x.
+    STEP_NS = 10**9 // SIM_HZ
+    def __init__(self, engine, realtime=True, speed=1):
+        self.engine = engine; self.realtime = realtime; self.speed_idx = FAST_FORWARD.index(speed)
+        self.acc = self.STEP_NS; self.last = time.perf_counter_ns(); self.frames = 0; self.dropped_ns = 0
+    @property
+    def speed(self): return FAST_FORWARD[self.speed_idx]
+    def handle_input(self, input_sys):
+        k = input_sys.get_input() if input_sys else None
+        if k == 'RIGHT': self.speed_idx = min(self.speed_idx + 1, len(FAST_FORWARD) - 1)
+        elif k == 'LEFT': self.speed_idx = max(self.speed_idx - 1, 0)
+        return k
+    def advance(self):
+        now = time.perf_counter_ns()
+        self.acc += (now - self.last if self.realtime else self.STEP_NS) * self.speed; self.last = now
+        steps = 0
+        while self.acc >= self.STEP_NS and not self.engine.game_over:
+            if steps == MAX_STEPS_PER_FRAME: self.dropped_ns += self.acc; self.acc = 0; break
+            self.engine.step(); self.acc -= self.STEP_NS; steps += 1
+        self.frames += 1
+        return steps
+
+class FrameProfiler:
+    # Phase timers for the battle loops. PROFILER is None unless --profile/WW_PROFILE is given or F3 is
+    # pressed in battle, and then nothing is timed at all: attach() wraps the engine's step and its
+    # status/event/particle/projectile passes per instance, and the render loop's marks sit behind an
+    # `if prof`. Walker updates are what is left of a step after the wrapped passes. The last
+    # PROFILE_FRAMES frames are kept as (start, duration, spans, counts) for the overlay and exports.
+    SIM = ("statuses", "events", "walkers", "projectiles", "particle_update")
+    FRAME = ("input", "sim", "background", "units", "particles", "hud", "show")
+    def __init__(self, frames=PROFILE_FRAMES):
+        self.frames = deque(maxlen=frames); self.spans = []; self.engine = None; self.overlay = False
+        self.origin = self.start = self.last = time.perf_counter_ns()
+    def timer(self, name, fn):
+        def timed(*a):
+            start = time.perf_counter_ns(); r = fn(*a); self.spans.append((name, start, time.perf_counter_ns() - start)); return r
+        return timed
+    def attach(self, engine):
+        if self.engine is engine: return
+        self.engine = engine; engine.step = self.timer("step", engine.step)
+        for obj, attr, name in ((getattr(engine, 'statuses', None), 'advance', "statuses"), (getattr(engine, 'events', None), 'process', "events"),
+                                (engine.particles, 'update', "particle_update"), (engine, 'update_projectiles', "projectiles")):
+            if obj is not None and hasattr(obj, attr): setattr(obj, attr, self.timer(name, getattr(obj, attr)))
+    def begin(self): self.spans = []; self.start = self.last = time.perf_counter_ns()
+    def mark(self, name):
+        now = time.perf_counter_ns(); self.spans.append((name, self.last, now - self.last)); self.last = now
+    def end(self, engine):
+        now = time.perf_counter_ns()
+        walkers = engine.p_count + engine.e_count if isinstance(engine, ArraySiegeEngine) else len(engine.walkers)
+        self.frames.append((self.start, now - self.start, self.spans, (walkers, len(engine.particles), len(engine.projectiles))))
+    def phases(self, spans):
+        t = dict.fromkeys(self.FRAME + self.SIM, 0); steps = 0
+        for name, _, dur in spans:
+            if name == "step": steps += 1; t["walkers"] += dur
+            else: t[name] += dur
+        t["walkers"] -= sum(t[k] for k in self.SIM if k != "walkers")
+        return t, steps
+    def fps(self, n=30):
+        recent = list(self.frames)[-n:]
+        return (len(recent) * 1e9 / sum(f[1] for f in recent), recent[-1][1] / 1e6) if recent else (0.0, 0.0)
+    def draw(self, lcd):
+        if not self.frames: return
+        fps, ms = self.fps(); walkers, particles, projectiles = self.frames[-1][3]
+        lcd.fill_rect(0, 106, 112, 22, BLACK)
+        lcd.text(f"{fps:4.1f}FPS {ms:4.1f}ms", 2, 107, YELLOW); lcd.text(f"W{walkers} P{particles} J{projectiles}", 2, 117, YELLOW)
+    def write_csv(self, path):
+        with open(path, "w", newline="") as f:
+            out = csv.writer(f); out.writerow(("frame_start_ms", "frame_ms", "steps", *(k + "_ms" for k in self.FRAME + self.SIM), "walkers", "particles", "projectiles"))
+            for start, dur, spans, counts in self.frames:
+                t, steps = self.phases(spans)
+                out.writerow((f"{(start - self.origin) / 1e6:.3f}", f"{dur / 1e6:.3f}", steps, *(f"{t[k] / 1e6:.3f}" for k in self.FRAME + self.SIM), *counts))
+    def write_trace(self, path):
+        # Chrome trace-event JSON (chrome://tracing, Perfetto): one complete event per frame and per span.
+        events = []
+        for i, (start, dur, spans, counts) in enumerate(self.frames):
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 1, "ts": (start - self.origin) / 1000, "dur": dur / 1000,
+                           "args": {"walkers": counts[0], "particles": counts[1], "projectiles": counts[2]}})
+            events += [{"name": name, "ph": "X", "pid": 1, "tid": 1, "ts": (t0 - self.origin) / 1000, "dur": d / 1000} for name, t0, d in spans]
+        with open(path, "w") as f: json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    def export(self, prefix): self.write_trace(prefix + ".json"); self.write_csv(prefix + ".csv")
+
+PROFILER = None
+def toggle_profiler(engine):
+    # F3 in battle: start profiling if it is off and flip the overlay.
+    global PROFILER
+    if PROFILER is None: PROFILER = FrameProfiler()
+    PROFILER.attach(engine); PROFILER.overlay = not PROFILER.overlay; PROFILER.begin()
+    return PROFILER
+
+class DuelEngine:
+    def __init__(self, player, enemy, seed=None):
+        self.rng = random.Random(seed) # the duel's own stream, as in SiegeEngine
+        self.player = player; self.enemy = enemy
+        self.p_walker = Walker(player, "LEFT", self.rng); self.e_walker = Walker(enemy, "RIGHT", self.rng)
+        self.walkers = [self.p_walker, self.e_walker]; self.particles = ParticlePool(rng=self.rng); self.projectiles = []
+        self.statuses = StatusBoard(); self.p_walker.statuses = self.e_walker.statuses = self.statuses
+        player.hp = player.max_hp; enemy.hp = enemy.max_hp
+        self.game_over = False; self.win = False; self.tick = 0
+    def step(self):
+        self.statuses.advance(self.tick)
+        all_walkers = [self.p_walker, self.e_walker]
+        self.p_walker.update(all_walkers, self.particles, self.projectiles)
+        self.e_walker.update(all_walkers, self.particles, self.projectiles)
+        self.particles.update(); self.update_projectiles()
+        self.walkers = sorted(all_walkers, key=lambda w: w.y)
+        self.tick += 1
+        if self.p_walker.state == "DEAD": self.game_over = True; self.win = False
+        elif self.e_walker.state == "DEAD": self.game_over = True; self.win = True
+        return not self.game_over
+    def update_projectiles(self): self.projectiles = [p for p in self.projectiles if p.update(self.particles)]
+    def run(self, max_ticks=None):
+        while not self.game_over and (max_ticks is None or self.tick < max_ticks): self.step()
+        return self.finish()
+    def finish(self):
+        self.player.hp = self.player.max_hp
+        return BattleResult(self.win, self.tick, [self.player] if not self.win else [], [])
 
-# --- 6. GAME MODES ---
+def simulate_siege(army, dungeon_data, seed=None, max_ticks=None, max_on_field=None, enemy_count=10, core=None):
+    return make_siege_engine(army, dungeon_data, seed, max_on_field, enemy_count, core).run(max_ticks)
+
+def simulate_duel(player, enemy, seed=None, max_ticks=None):
+    return DuelEngine(player, enemy, seed).run(max_ticks)
+
+# Battle replays. Every live battle runs on a fresh seed; the engine builds its own random.Random from
+# it, and everything the battle draws (enemy rolls, spawns, dodges, spells, particles) comes from that
+# stream, so seed + starting units + settings reproduce it exactly whatever the rest of the game drew. Keys are kept per
+# frame only to replay fast-forward as it was watched: speed never changes the tick sequence.
+REPLAY_MAGIC = b"WWRP"; REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct("<4sHII") # magic, version, JSON header bytes, unit save image bytes
+
+def battle_checksum(engine):
+    # Digest of the end state (tick, winner, log, every walker, the battle's random streams); any divergence changes it.
+    h = hashlib.blake2b(digest_size=8)
+    h.update(struct.pack("<q?", engine.tick, engine.win)); h.update(repr(getattr(engine, 'log', ())).encode())
+    for w in engine.walkers: h.update(struct.pack("<?qdd", w.side == "LEFT", w.unit.hp, w.x, w.y) + w.unit.race.encode())
+    h.update(repr(engine.rng.getstate()).encode())
+    if hasattr(engine, 'np_rng'): h.update(repr(engine.np_rng.bit_generator.state).encode())
+    return h.hexdigest()
+
+class ReplayArmy:
+    # Stand-in Army for replays: fused recruits join units in memory and nothing is saved.
+    def __init__(self, units): self.units = units
+    def add_recruit(self, u): self.units.append(u)
+
+class BattleLog:
+    # One battle: kind ("siege"/"duel"), seed, settings, the starting units as a binary save image,
+    # (frame, key) inputs and the final checksum. A replay's own checksum lands in .replayed.
+    def __init__(self, kind, seed, units, settings=None, image=None):
+        self.kind = kind; self.seed = seed; self.settings = settings or {}; self.keys = []
+        self.image = image if image is not None else encode_save(0, (), [], units)
+        self.checksum = None; self.ticks = None; self.replayed = None
+    def units(self):
+        image = SaveImage(self.image)
+        return [FantasyUnit(load_data=image.unit_data(i)) for i in range(image.count)]
+    def key(self, frame, k): self.keys.append((frame, k))
+    def finish(self, engine, path):
+        self.checksum = battle_checksum(engine); self.ticks = engine.tick; self.write(path)
+    def check(self, engine): self.replayed = battle_checksum(engine); return self.replayed == self.checksum
+    def write(self, path):
+        head = json.dumps({"kind": self.kind, "seed": self.seed, "settings": self.settings, "keys": self.keys,
+                           "ticks": self.ticks, "checksum": self.checksum}, separators=(",", ":")).encode()
+        with open(path, "wb") as f: f.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, len(head), len(self.image)) + head + self.image)
+    @classmethod
+    def read(cls, path):
+        with open(path, "rb") as f: data = f.read()
+        magic, version, n_head, n_image = REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC: raise ValueError(f"{path}: not a WiFi Warriors battle log")
+        if version > REPLAY_VERSION: raise ValueError(f"{path}: battle log version {version} is newer than this game")
+        head = json.loads(data[REPLAY_HEADER.size:REPLAY_HEADER.size + n_head])
+        log = cls(head['kind'], head['seed'], None, head['settings'], data[REPLAY_HEADER.size + n_head:REPLAY_HEADER.size + n_head + n_image])
+        log.keys = [tuple(k) for k in head['keys']]; log.checksum = head['checksum']; log.ticks = head['ticks']
+        return log
+    def inputs(self):
+        keys = [None] * (max((f for f, _ in self.keys), default=-1) + 1)
+        for f, k in self.keys: keys[f] = k
+        return keys
+
+def start_battle_log(kind, units, settings=None):
+    # A fresh seed for a live battle, and its BattleLog when recording is on.
+    seed = random.getrandbits(32)
+    return seed, (BattleLog(kind, seed, units, settings) if BATTLE_LOG_DIR else None)
+
+def battle_log_path(log):
+    os.makedirs(BATTLE_LOG_DIR, exist_ok=True)
+    return os.path.join(BATTLE_LOG_DIR, f"{log.kind}_{time.strftime('%Y%m%d_%H%M%S')}_{log.seed:08x}.wwr")
+
+def replay_battle(path, lcd=None, audio=None):
+    # Re-runs a recorded battle: headless at full speed, or through the battle screen when lcd is given.
+    log = BattleLog.read(path); units = log.units(); s = log.settings
+    if lcd is not None:
+        input_sys = InputController(ReplaySource(log.inputs()))
+        if log.kind == "siege": run_siege(lcd, ReplayArmy(units), s['dungeon'], audio or SoundEngine(), input_sys=input_sys, replay=log)
+        else: run_duel_walker(lcd, audio or SoundEngine(), units[0], units[1], input_sys, replay=log)
+        return log
+    if log.kind == "siege": engine = make_siege_engine(ReplayArmy(units), s['dungeon'], log.seed, s['max_on_field'], s['enemy_count'], s['core'])
+    else: engine = DuelEngine(units[0], units[1], log.seed)
+    while not engine.game_over: engine.step()
+    log.check(engine)
+    return log
+
+def report_replay(log):
+    ok = log.replayed == log.checksum
+    print(f"{log.kind} seed {log.seed:08x}, {log.ticks} ticks: checksum {log.replayed} " + ("matches" if ok else f"DIVERGED (recorded {log.checksum})"))
+    return 0 if ok else 1
+
+def apply_siege_result(army, dungeon_data, result):
+    if len(result.casualties) > 0: army.remove_casualties_batch(result.casualties)
+    if result.win:
+        army.gold += int(dungeon_data['reward'])
+        if dungeon_data['lvl'] not in army.beaten_levels: army.beaten_levels.append(dungeon_data['lvl'])
+    for u in army.units: u.reset_buffs(); u.hp = u.max_hp
+    army.save_game()
+
+def draw_battle_field(lcd, bg_type, engine, prof=None):
+    draw_background(lcd, bg_type)
+    if prof: prof.mark("background")
+    for w in engine.walkers: w.draw(lcd)
+    for p in engine.projectiles: p.draw(lcd)
+    if prof: prof.mark("units")
+    engine.particles.draw(lcd)
+    if prof: prof.mark("particles")
+
+# --- 7. GAME MODES ---
 def select_champion(lcd, input_sys, audio, army):
     idx = 0
     while True:
-        draw_book_bg(lcd); lcd.text("DEPLOY UNIT", 40, 10, INK)
+        draw_background(lcd, "BOOK"); lcd.text("DEPLOY UNIT", 40, 10, INK)
         start = 0
         if idx > 4: start = idx - 4
         for i in range(start, min(len(army.units), start+5)):
@@ -828,29 +2028,35 @@ def select_champion(lcd, input_sys, audio, army):
         sel = army.units[idx]
         lcd.fill_rect(10, 100, 140, 25, INK); lcd.rect(10, 100, 140, 25, GREY) 
         lcd.text(f"HP:{sel.hp}/{sel.max_hp}", 15, 104, WHITE)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'DOWN': idx = (idx + 1) % len(army.units); audio.sfx_blip()
         elif k == 'UP': idx = (idx - 1) % len(army.units); audio.sfx_blip()
         elif k == 'B': return None 
         elif k == 'A': return sel 
 
-def run_wifi_scan(lcd, input_sys, audio, army):
-    lcd.fill(BLACK); lcd.text("SIMULATING WIFI...", 20, 60, GREEN); lcd.show(); pygame.time.delay(1000)
-    signals = []
-    names = ["Neighbor_WiFi", "FBI Surveillance", "NETGEAR99", "Starbucks_Guest", "iPhone Hotspot", "Linksys"]
-    for i in range(5):
-        ssid = random.choice(names)
-        fake_seed = random.randint(1000, 99999999)
-        temp = FantasyUnit(seed=fake_seed)
-        d_name = f"{temp.race} L{temp.level}"; d_col = ELEMENTS[temp.element]['col']
-        signals.append({'ssid': ssid, 'seed': fake_seed, 'd_name': d_name, 'd_col': d_col, 'is_merch': (fake_seed % 5 == 0)})
+def run_wifi_scan(lcd, input_sys, audio, army, source=None):
+    spec = source or os.environ.get("WW_SCAN_SOURCE", "sim")
+    lcd.fill(BLACK); lcd.text("SIMULATING WIFI..." if spec == "sim" else "READING SCAN...", 20, 60, GREEN); lcd.show(); input_sys.pause(1000)
+    batches = encounter_batches(dedupe_scan(open_scan(spec))); signals = []
+    def more():
+        batch = next(batches, None)
+        if batch:
+            for s in batch: s['new'] = s['mac'] not in army.history # the Bloom filter answers for unseen networks
+            signals.extend(batch); army.history.record_many([s['mac'] for s in batch])
+        return batch is not None
+    more()
+    if not signals: lcd.fill(BLACK); lcd.text("NO SIGNALS", 45, 60, RED); lcd.show(); input_sys.pause(1000); return
     idx = 0
     while True:
         lcd.fill(BLACK); lcd.text("DETECTED SIGNALS", 20, 5, WHITE)
-        for i, s in enumerate(signals):
-            prefix = ">" if i == idx else " "; lcd.text(f"{prefix} {s['ssid'][:12]}", 10, 25 + (i*20), WHITE); lcd.text(f"  {s['d_name']}", 10, 35 + (i*20), s['d_col'])
-        lcd.show(); k = input_sys.get_input()
-        if k == 'DOWN': idx = (idx+1)%len(signals); audio.sfx_blip()
+        start = max(0, idx - 4)
+        for i in range(start, min(len(signals), start + 5)):
+            s = signals[i]; prefix = ">" if i == idx else " "; row = i - start
+            lcd.text(f"{prefix}{'*' if s['new'] else ' '}{s['ssid'][:12]}", 10, 25 + (row*20), WHITE); lcd.text(f"  {s['d_name']}", 10, 35 + (row*20), s['d_col'])
+        k = menu_frame(lcd, input_sys)
+        if k == 'DOWN':
+            if idx + 1 == len(signals): more()
+            idx = (idx+1)%len(signals); audio.sfx_blip()
         elif k == 'UP': idx = (idx-1)%len(signals); audio.sfx_blip()
         elif k == 'B': return
         elif k == 'A':
@@ -861,106 +2067,109 @@ def run_wifi_scan(lcd, input_sys, audio, army):
             danger_level = champion.level + random.randint(-1, 3)
             if danger_level < 1: danger_level = 1
             enemy = FantasyUnit(seed=target_data['seed'], level_scale=danger_level)            
-            lcd.fill(BLACK); lcd.text("ENCOUNTER!", 40, 50, RED); lcd.text(enemy.name, 40, 65, WHITE); lcd.show(); pygame.time.delay(1000)
-            win = run_duel_walker(lcd, audio, champion, enemy); army.remember_mac(target_data['seed'])
+            lcd.fill(BLACK); lcd.text("ENCOUNTER!", 40, 50, RED); lcd.text(enemy.name, 40, 65, WHITE); lcd.show(); input_sys.pause(1000)
+            win = run_duel_walker(lcd, audio, champion, enemy, input_sys); army.remember_mac(target_data['mac'])
             if win:
                 reward = enemy.level * 15; army.gold += reward; army.add_recruit(enemy)
-                lcd.fill(BLACK); lcd.text("VICTORY!", 40, 40, GREEN); lcd.text(f"Got {reward}g", 40, 60, WHITE); lcd.show(); audio.sfx_coin(); pygame.time.delay(1000)
+                lcd.fill(BLACK); lcd.text("VICTORY!", 40, 40, GREEN); lcd.text(f"Got {reward}g", 40, 60, WHITE); lcd.show(); audio.sfx_coin(); input_sys.pause(1000)
             else:
                 lcd.fill(BLACK); lcd.text("DEFEAT", 55, 40, RED)
                 if champion.name == "Player": lcd.text("You fled...", 40, 60, GREY); champion.hp = 1 
                 else: lcd.text(f"{champion.name} has", 30, 60, RED); lcd.text("FALLEN!", 50, 75, RED); army.remove_dead(champion)
-                lcd.show(); audio.sfx_lose(); pygame.time.delay(3000)
+                lcd.show(); audio.sfx_lose(); input_sys.pause(3000)
             return
 
-def run_duel_walker(lcd, audio, player, enemy):
-    p_walker = Walker(player, "LEFT"); e_walker = Walker(enemy, "RIGHT")
-    particles = []; projectiles = []
-    player.hp = player.max_hp; enemy.hp = enemy.max_hp 
-    while True:
-        all_walkers = [p_walker, e_walker]
-        p_walker.update(all_walkers, particles, projectiles)
-        e_walker.update(all_walkers, particles, projectiles)
-        particles = [p for p in particles if p.update()]
-        projectiles = [p for p in projectiles if p.update(particles)]
-        draw_forest_bg(lcd)
-        all_walkers.sort(key=lambda w: w.y)
-        for w in all_walkers: w.draw(lcd)
-        for p in projectiles: p.draw(lcd)
-        for p in particles: p.draw(lcd)
+def encounter_batches(aps, batch=SCAN_BATCH):
+    # Turns an AP stream into menu signals, building the preview FantasyUnit for a batch at a time so
+    # a huge log only costs what the player scrolls through. The BSSID is the encounter seed.
+    batch_aps = []
+    for ap in aps:
+        batch_aps.append(ap)
+        if len(batch_aps) == batch: yield [scan_signal(a) for a in batch_aps]; batch_aps = []
+    if batch_aps: yield [scan_signal(a) for a in batch_aps]
+
+def scan_signal(ap):
+    temp = unit_template(ap.mac)
+    return {'ssid': ap.ssid or "<hidden>", 'mac': ap.mac, 'seed': ap.mac, 'd_name': f"{temp.race} L{temp.level}",
+            'd_col': ELEMENTS[temp.element]['col'], 'is_merch': (ap.mac % 5 == 0)}
+
+def draw_speed(lcd, loop, y):
+    if loop.speed > 1: lcd.text(f"x{loop.speed}", 142, y, WHITE)
+
+def run_duel_walker(lcd, audio, player, enemy, input_sys=None, replay=None):
+    if replay: seed = replay.seed; rec = None
+    else: seed, rec = start_battle_log("duel", [player, enemy])
+    engine = DuelEngine(player, enemy, seed); loop = FixedStepLoop(engine, input_sys.realtime if input_sys else True)
+    prof = PROFILER
+    if prof: prof.attach(engine)
+    while not engine.game_over:
+        if prof: prof.begin()
+        k = loop.handle_input(input_sys)
+        if k == 'F3': prof = toggle_profiler(engine)
+        if rec and k: rec.key(loop.frames, k)
+        if prof: prof.mark("input")
+        loop.advance()
+        if prof: prof.mark("sim")
+        draw_battle_field(lcd, "FOREST", engine, prof)
         lcd.fill_rect(0, 0, 160, 25, BLACK)
         lcd.text(f"{player.name} L{player.level}", 5, 5, BLUE)
         lcd.text(f"HP:{player.hp}/{player.max_hp}", 5, 15, BLUE)
         lcd.text(f"{enemy.name} L{enemy.level}", 85, 5, RED)
         lcd.text(f"HP:{enemy.hp}/{enemy.max_hp}", 85, 15, RED)
+        draw_speed(lcd, loop, 27)
+        if prof:
+            if prof.overlay: prof.draw(lcd)
+            prof.mark("hud")
         lcd.show()
-        if p_walker.state == "DEAD": 
-            audio.sfx_lose(); player.hp = player.max_hp; return False
-        if e_walker.state == "DEAD":
-            audio.sfx_crit(); player.hp = player.max_hp; return True
+        if prof: prof.mark("show"); prof.end(engine)
+    if rec: rec.finish(engine, battle_log_path(rec))
+    if replay: replay.check(engine)
+    if engine.win: audio.sfx_crit()
+    else: audio.sfx_lose()
+    return engine.finish().win
 
-def run_siege(lcd, army, dungeon_data, audio, tier=1):
+def run_siege(lcd, army, dungeon_data, audio, tier=1, input_sys=None, replay=None):
     if len(army.units) == 0: return
-    player_reserve = army.units[:]
-    enemy_lvl = int(dungeon_data['lvl'])
-    enemy_reserve = [FantasyUnit(level_scale=enemy_lvl) for _ in range(10)]
-    active_walkers = []; dead_player_units = []; particles = []; projectiles = [] 
-    spell_timers = {}; game_over = False; win = False; MAX_ON_FIELD = 12 
-    active_channels = {}
-    battle_log = []
-    
-    while not game_over:
-        p_on_field = [w for w in active_walkers if w.side == "LEFT" and w.state != "DEAD"]
-        e_on_field = [w for w in active_walkers if w.side == "RIGHT" and w.state != "DEAD"]
-        if len(p_on_field) < MAX_ON_FIELD and len(player_reserve) > 0: active_walkers.append(Walker(player_reserve.pop(0), "LEFT"))
-        if len(e_on_field) < MAX_ON_FIELD and len(enemy_reserve) > 0: active_walkers.append(Walker(enemy_reserve.pop(0), "RIGHT"))
-        
-        if len(p_on_field) == 0 and len(player_reserve) == 0: game_over = True; win = False
-        elif len(e_on_field) == 0 and len(enemy_reserve) == 0: game_over = True; win = True
-        
-        check_field_events(active_walkers, particles, spell_timers, army, battle_log, lcd, active_channels)
-
-        next_walkers = []
-        for w in active_walkers:
-            w.update(active_walkers, particles, projectiles) 
-            if w.state == "DEAD":
-                if w.side == "LEFT" and w.unit not in dead_player_units: dead_player_units.append(w.unit)
-            else: next_walkers.append(w)
-        active_walkers = next_walkers
-        particles = [p for p in particles if p.update()]
-        projectiles = [p for p in projectiles if p.update(particles)]
-        
-        if dungeon_data.get('type') == 'CAVE': draw_cave_bg(lcd)
-        elif dungeon_data.get('type') == 'LAVA': draw_lava_bg(lcd)
-        elif dungeon_data.get('type') == 'CASTLE': draw_castle_bg(lcd)
-        elif dungeon_data.get('type') == 'SNOW': draw_snow_bg(lcd)
-        else: draw_forest_bg(lcd)
-        active_walkers.sort(key=lambda w: w.y)
-        for w in active_walkers: w.draw(lcd)
-        for p in projectiles: p.draw(lcd)
-        for p in particles: p.draw(lcd)
+    if replay: s = replay.settings; seed = replay.seed; rec = None
+    else: s = {}; seed, rec = start_battle_log("siege", army.units)
+    engine = make_siege_engine(army, dungeon_data, seed, s.get('max_on_field'), s.get('enemy_count', 10), s.get('core'))
+    loop = FixedStepLoop(engine, input_sys.realtime if input_sys else True)
+    if rec: rec.settings = {"dungeon": dungeon_data, "max_on_field": engine.max_on_field, "enemy_count": len(engine.enemy_reserve),
+                            "core": "array" if isinstance(engine, ArraySiegeEngine) else "object"}
+    prof = PROFILER
+    if prof: prof.attach(engine)
+    while not engine.game_over:
+        if prof: prof.begin()
+        k = loop.handle_input(input_sys)
+        if k == 'F3': prof = toggle_profiler(engine)
+        if rec and k: rec.key(loop.frames, k)
+        if prof: prof.mark("input")
+        loop.advance()
+        if prof: prof.mark("sim")
+        draw_battle_field(lcd, dungeon_data.get('type'), engine, prof)
         lcd.fill_rect(0,0,160,10,BLACK)
-        lcd.text(f"YOU:{len(player_reserve)+len(p_on_field)}", 5, 3, BLUE)
-        lcd.text(f"THEM:{len(enemy_reserve)+len(e_on_field)}", 80, 3, RED)
+        you, them = engine.remaining()
+        lcd.text(f"YOU:{you}", 5, 3, BLUE); lcd.text(f"THEM:{them}", 80, 3, RED)
+        draw_speed(lcd, loop, 12)
+        if prof:
+            if prof.overlay: prof.draw(lcd)
+            prof.mark("hud")
         lcd.show()
-    
-    if len(dead_player_units) > 0:
-        lcd.fill(BLACK); lcd.text("CASUALTIES", 40, 10, RED)
-        army.remove_casualties_batch(dead_player_units) 
-    
-    if win:
-        reward = int(dungeon_data['reward'])
-        lcd.fill(BLACK); lcd.text("VICTORY!", 50, 20, GREEN); army.gold += reward
-        if dungeon_data['lvl'] not in army.beaten_levels: army.beaten_levels.append(dungeon_data['lvl'])
-        lcd.show(); audio.sfx_win(); pygame.time.delay(3000)
-    else: lcd.text("DEFEAT...", 50, 40, RED); audio.sfx_lose(); lcd.show(); pygame.time.delay(3000)
-    for u in army.units: u.reset_buffs(); u.hp = u.max_hp
-    army.save_game()
+        if prof: prof.mark("show"); prof.end(engine)
+    if rec: rec.finish(engine, battle_log_path(rec))
+    if replay: replay.check(engine)
+    result = engine.result(); pause = input_sys.pause if input_sys else pygame.time.delay
+    if len(result.casualties) > 0: lcd.fill(BLACK); lcd.text("CASUALTIES", 40, 10, RED)
+    if result.win:
+        lcd.fill(BLACK); lcd.text("VICTORY!", 50, 20, GREEN)
+        lcd.show(); audio.sfx_win(); pause(3000)
+    else: lcd.text("DEFEAT...", 50, 40, RED); audio.sfx_lose(); lcd.show(); pause(3000)
+    if not replay: apply_siege_result(army, dungeon_data, result)
 
 def run_dungeon_select(lcd, input_sys, audio, army):
     idx = 0; tier = 1
     while True:
-        draw_book_bg(lcd); lcd.text("CAMPAIGN MAP", 30, 5, INK)
+        draw_background(lcd, "BOOK"); lcd.text("CAMPAIGN MAP", 30, 5, INK)
         d = DUNGEONS[idx]
         name_str = d['name']
         if d['lvl'] in army.beaten_levels: name_str += " *"; lcd.text("CLEARED", 100, 20, GREEN)
@@ -968,33 +2177,32 @@ def run_dungeon_select(lcd, input_sys, audio, army):
         lcd.text(name_str, 30, 35, INK)
         lcd.text(f"Waves: {d['waves']}", 40, 85, INK)
         lcd.fill_rect(30, 110, 100, 15, INK); lcd.text("PRESS [A]", 45, 114, PAPER)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'RIGHT': idx = (idx+1)%len(DUNGEONS); audio.sfx_blip()
         elif k == 'LEFT': idx = (idx-1)%len(DUNGEONS); audio.sfx_blip()
         elif k == 'B': return
         elif k == 'A': 
-            run_siege(lcd, army, d, audio, tier=tier); return
+            run_siege(lcd, army, d, audio, tier=tier, input_sys=input_sys); return
 
 def run_blacksmith(lcd, input_sys, audio, army):
     u = select_champion(lcd, input_sys, audio, army)
     if not u: return
     cat_idx = 0; categories = ["WEAPONS", "ARMOR"]
     while True:
-        draw_book_bg(lcd); lcd.text("BLACKSMITH", 40, 15, INK)
+        draw_background(lcd, "BOOK"); lcd.text("BLACKSMITH", 40, 15, INK)
         lcd.text(f"Customer: {u.name}", 20, 30, BLUE); lcd.text(f"< {categories[cat_idx]} >", 40, 60, RED)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'RIGHT': cat_idx = 1; audio.sfx_blip()
         elif k == 'LEFT': cat_idx = 0; audio.sfx_blip()
         elif k == 'B': return
         elif k == 'A': break 
     target_db = WEAPONS if cat_idx == 0 else ARMORS
-    shop_items = [k for k, v in target_db.items() if u.race in v['classes']]
-    shop_items.sort(key=lambda x: target_db[x]['cost'])
+    shop_items = EQUIPMENT.for_class("weapon" if cat_idx == 0 else "armor", u.race)
     if len(shop_items) == 0:
-        lcd.fill(BLACK); lcd.text("NO ITEMS FOR", 30, 50, WHITE); lcd.text(f"{u.race} CLASS", 30, 65, WHITE); lcd.show(); pygame.time.delay(2000); return
+        lcd.fill(BLACK); lcd.text("NO ITEMS FOR", 30, 50, WHITE); lcd.text(f"{u.race} CLASS", 30, 65, WHITE); lcd.show(); input_sys.pause(2000); return
     idx = 0
     while True:
-        draw_book_bg(lcd); lcd.text("BLACKSMITH", 45, 10, INK); lcd.text(f"Gold: {army.gold}", 45, 115, INK)
+        draw_background(lcd, "BOOK"); lcd.text("BLACKSMITH", 45, 10, INK); lcd.text(f"Gold: {army.gold}", 45, 115, INK)
         item_name = shop_items[idx]; stats = target_db[item_name]; col = stats.get('col', INK) 
         lcd.text(f"< {item_name} >", 10, 40, col)
         if cat_idx == 0: lcd.text(f"Damage: +{stats['dmg']}", 30, 60, INK)
@@ -1005,7 +2213,7 @@ def run_blacksmith(lcd, input_sys, audio, army):
         else:
             if army.gold >= stats['cost']: lcd.text("PRESS A TO BUY", 30, 95, INK)
             else: lcd.text("TOO EXPENSIVE", 30, 95, GREY)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'RIGHT': idx = (idx + 1) % len(shop_items); audio.sfx_blip()
         elif k == 'LEFT': idx = (idx - 1) % len(shop_items); audio.sfx_blip()
         elif k == 'B': return
@@ -1017,17 +2225,24 @@ def run_blacksmith(lcd, input_sys, audio, army):
                 army.save_game(); audio.sfx_coin()
             else: audio.sfx_lose()
 
+STOCKS = LRUCache(256)
+
+def merchant_stock(seed):
+    stock = STOCKS.get(seed)
+    if stock is None:
+        rng = random.Random(seed); keys = list(MERCHANT_ITEMS.keys())
+        stock = STOCKS.put(seed, tuple(rng.choice(keys) for _ in range(3)))
+    return stock
+
 def run_merchant_shop(lcd, input_sys, audio, army, seed):
-    random.seed(seed); keys = list(MERCHANT_ITEMS.keys())
-    for_sale = []; 
-    for _ in range(3): for_sale.append(random.choice(keys))
+    for_sale = merchant_stock(seed)
     idx = 0
     while True:
-        draw_book_bg(lcd); lcd.text("MERCHANT", 45, 10, INK); lcd.text(f"Gold: {army.gold}", 45, 115, INK)
+        draw_background(lcd, "BOOK"); lcd.text("MERCHANT", 45, 10, INK); lcd.text(f"Gold: {army.gold}", 45, 115, INK)
         item_name = for_sale[idx]; stats = MERCHANT_ITEMS[item_name]
         lcd.text(f"< {item_name} >", 10, 40, stats.get('col', INK))
         lcd.text(f"Cost: {stats.get('cost', 500)}g", 30, 60, INK)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'RIGHT': idx = (idx + 1) % 3; audio.sfx_blip()
         elif k == 'LEFT': idx = (idx - 1) % 3; audio.sfx_blip()
         elif k == 'B': return
@@ -1039,14 +2254,14 @@ def run_merchant_shop(lcd, input_sys, audio, army, seed):
                 else:
                     g_type = "weapon" if "dmg" in stats else "armor"
                     cascade_gear(army, item_name, g_type)
-                    lcd.text("BOUGHT!", 40, 50, GREEN); lcd.show(); pygame.time.delay(1000)
+                    lcd.text("BOUGHT!", 40, 50, GREEN); lcd.show(); input_sys.pause(1000)
                 army.save_game(); audio.sfx_coin()
             else: audio.sfx_lose()
 
 def run_triage(lcd, input_sys, audio, army):
     idx = 0
     while True:
-        draw_book_bg(lcd); lcd.text("TRIAGE TENT", 40, 10, INK); lcd.text(f"Gold: {army.gold}", 40, 20, INK)
+        draw_background(lcd, "BOOK"); lcd.text("TRIAGE TENT", 40, 10, INK); lcd.text(f"Gold: {army.gold}", 40, 20, INK)
         start = 0
         if idx > 4: start = idx - 4
         for i in range(start, min(len(army.units), start+5)):
@@ -1058,7 +2273,7 @@ def run_triage(lcd, input_sys, audio, army):
             else: lcd.text(f"{cost}g", 110, 40 + ((i-start)*15), INK)
         sel = army.units[idx]
         lcd.fill_rect(10, 110, 140, 15, INK); lcd.text(f"HP: {sel.hp}/{sel.max_hp}", 15, 114, WHITE)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'DOWN': idx = (idx + 1) % len(army.units); audio.sfx_blip()
         elif k == 'UP': idx = (idx - 1) % len(army.units); audio.sfx_blip()
         elif k == 'B': return 
@@ -1072,7 +2287,7 @@ def run_triage(lcd, input_sys, audio, army):
 def run_dismiss(lcd, input_sys, audio, army):
     idx = 0
     while True:
-        draw_book_bg(lcd); lcd.text("DISMISS UNIT", 35, 10, INK)
+        draw_background(lcd, "BOOK"); lcd.text("DISMISS UNIT", 35, 10, INK)
         start = 0
         if idx > 4: start = idx - 4
         for i in range(start, min(len(army.units), start+5)):
@@ -1082,7 +2297,7 @@ def run_dismiss(lcd, input_sys, audio, army):
             if i == 0: value = 0 
             lcd.text(f"{prefix}{u.name}", 15, 40 + ((i-start)*15), INK)
             lcd.text(f"+{value}g", 110, 40 + ((i-start)*15), val_col)
-        lcd.text("Permanently remove?", 10, 115, RED); lcd.show(); k = input_sys.get_input()
+        lcd.text("Permanently remove?", 10, 115, RED); k = menu_frame(lcd, input_sys)
         if k == 'DOWN': idx = (idx + 1) % len(army.units); audio.sfx_blip()
         elif k == 'UP': idx = (idx - 1) % len(army.units); audio.sfx_blip()
         elif k == 'B': return
@@ -1093,14 +2308,14 @@ def run_dismiss(lcd, input_sys, audio, army):
                 payout = (sel.level * 20) + 10
                 if sel.artifact: payout += 100
                 army.gold += payout
-                lcd.fill(BLACK); lcd.text(f"Farewell", 50, 50, WHITE); lcd.text(f"{sel.name}...", 40, 65, WHITE); lcd.show(); audio.sfx_coin(); pygame.time.delay(1000)
+                lcd.fill(BLACK); lcd.text(f"Farewell", 50, 50, WHITE); lcd.text(f"{sel.name}...", 40, 65, WHITE); lcd.show(); audio.sfx_coin(); input_sys.pause(1000)
                 army.remove_dead(sel); idx = 0 
                 if len(army.units) == 1: return
 
 def run_tactics(lcd, input_sys, audio, army):
     idx = 0; selected_idx = None
     while True:
-        draw_book_bg(lcd); lcd.text("TACTICS (ORDER)", 30, 10, INK)
+        draw_background(lcd, "BOOK"); lcd.text("TACTICS (ORDER)", 30, 10, INK)
         start = 0
         if idx > 4: start = idx - 4
         for i in range(start, min(len(army.units), start+5)):
@@ -1115,7 +2330,7 @@ def run_tactics(lcd, input_sys, audio, army):
         lcd.fill_rect(10, 110, 140, 15, INK)
         if selected_idx is None: lcd.text("[A] MOVE UNIT", 25, 114, WHITE)
         else: lcd.text("[A] PLACE HERE", 25, 114, YELLOW)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'DOWN': idx = (idx + 1) % len(army.units); audio.sfx_blip()
         elif k == 'UP': idx = (idx - 1) % len(army.units); audio.sfx_blip()
         elif k == 'B': 
@@ -1134,8 +2349,8 @@ def run_grimoire(lcd, input_sys, audio):
     page = 0
     book_pages = [r for r in RECIPES if r.get('type') in ["FUSION", "SPELL"]]
     while True:
-        draw_book_bg(lcd); lcd.text("GRIMOIRE", 45, 5, INK)
-        if len(book_pages) == 0: lcd.text("Pages Empty...", 30, 60, GREY); lcd.show(); pygame.time.delay(2000); return
+        draw_background(lcd, "BOOK"); lcd.text("GRIMOIRE", 45, 5, INK)
+        if len(book_pages) == 0: lcd.text("Pages Empty...", 30, 60, GREY); lcd.show(); input_sys.pause(2000); return
         r = book_pages[page]
         name = r.get('spawn') or r.get('family') or r.get('name') or "Unknown"
         r_type = r.get('type')
@@ -1155,7 +2370,7 @@ def run_grimoire(lcd, input_sys, audio):
         elif 'buff' in r: lcd.text(f"Effect: {r['buff']} +{r['val']}", 15, y_foot, BLUE)
         lcd.fill_rect(0, 115, 160, 13, PAPER) 
         lcd.text("< PREV", 10, 118, INK); lcd.text("NEXT >", 100, 118, INK)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'RIGHT': page = (page + 1) % len(book_pages); audio.sfx_blip()
         elif k == 'LEFT': page = (page - 1) % len(book_pages); audio.sfx_blip()
         elif k == 'B': return
@@ -1163,20 +2378,20 @@ def run_grimoire(lcd, input_sys, audio):
 def run_camp(lcd, input_sys, audio, army):
     menu_idx = 0; options = ["HEAL ALL", "TRIAGE", "DISMISS", "LEAVE"]
     while True:
-        draw_book_bg(lcd); lcd.text("BASE CAMP", 45, 15, INK); lcd.text(f"Gold: {army.gold}", 45, 30, INK)
+        draw_background(lcd, "BOOK"); lcd.text("BASE CAMP", 45, 15, INK); lcd.text(f"Gold: {army.gold}", 45, 30, INK)
         total_missing = sum([(u.max_hp - u.hp) for u in army.units]); lcd.text(f"Army Dmg: {total_missing}", 30, 45, RED)
         for i, opt in enumerate(options):
             y = 70 + (i * 15); prefix = ">" if i == menu_idx else " "; col = INK; text = opt
             if i == 0: text = f"HEAL ALL ({total_missing}g)"
             lcd.text(f"{prefix} {text}", 20, y, col)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'DOWN': menu_idx = (menu_idx + 1) % len(options); audio.sfx_blip()
         elif k == 'UP': menu_idx = (menu_idx - 1) % len(options); audio.sfx_blip()
         elif k == 'A':
             if menu_idx == 3: return 
             elif menu_idx == 0: 
                 if total_missing == 0: audio.sfx_blip()
-                elif army.gold >= total_missing: army.gold -= total_missing; [setattr(u, 'hp', u.max_hp) for u in army.units]; army.save_game(); audio.sfx_win(); pygame.time.delay(1000)
+                elif army.gold >= total_missing: army.gold -= total_missing; [setattr(u, 'hp', u.max_hp) for u in army.units]; army.save_game(); audio.sfx_win(); input_sys.pause(1000)
                 else: audio.sfx_lose()
             elif menu_idx == 1: run_triage(lcd, input_sys, audio, army)
             elif menu_idx == 2: run_dismiss(lcd, input_sys, audio, army)
@@ -1185,11 +2400,11 @@ def run_camp(lcd, input_sys, audio, army):
 def get_player_name(lcd, input_sys, audio):
     chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ "; name = ""; idx = 0
     while True:
-        draw_book_bg(lcd); lcd.text("NAME HERO", 40, 15, INK); lcd.rect(30, 35, 100, 20, INK); lcd.text(name + "_", 35, 41, BLUE)
+        draw_background(lcd, "BOOK"); lcd.text("NAME HERO", 40, 15, INK); lcd.rect(30, 35, 100, 20, INK); lcd.text(name + "_", 35, 41, BLUE)
         for i in range(5):
             c = chars[(idx - 2 + i) % len(chars)]; col = RED if i == 2 else GREY 
             lcd.text(c, 35 + (i * 20), 70, col)
-        lcd.text("[A] CONFIRM", 35, 115, GREEN); lcd.show(); k = input_sys.get_input()
+        lcd.text("[A] CONFIRM", 35, 115, GREEN); k = menu_frame(lcd, input_sys)
         if k == 'RIGHT': idx = (idx + 1) % len(chars); audio.sfx_blip()
         elif k == 'LEFT': idx = (idx - 1) % len(chars); audio.sfx_blip()
         elif k == 'A': 
@@ -1201,22 +2416,22 @@ def get_player_name(lcd, input_sys, audio):
 def select_class(lcd, input_sys, audio):
     classes = ["Warrior", "Paladin", "Mage", "Cleric", "Necro", "Archer", "Ninja"]; idx = 0
     while True:
-        draw_book_bg(lcd); lcd.text("CLASS", 55, 15, INK); c_name = classes[idx]; lcd.text(f"< {c_name} >", 40, 40, BLUE)
+        draw_background(lcd, "BOOK"); lcd.text("CLASS", 55, 15, INK); c_name = classes[idx]; lcd.text(f"< {c_name} >", 40, 40, BLUE)
         temp = FantasyUnit(manual_type=c_name); temp.draw(lcd, 75, 75); 
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys)
         if k == 'RIGHT': idx = (idx + 1) % len(classes); audio.sfx_blip()
         elif k == 'LEFT': idx = (idx - 1) % len(classes); audio.sfx_blip()
         elif k == 'A': return c_name
 
 def run_title_screen(lcd, input_sys):
     while True:
-        draw_book_bg(lcd); lcd.text("WIFI WARRIORS", 28, 30, RED); lcd.text("PC Edition", 35, 45, INK)
+        draw_background(lcd, "BOOK"); lcd.text("WIFI WARRIORS", 28, 30, RED); lcd.text("PC Edition", 35, 45, INK)
         if (pygame.time.get_ticks() // 500) % 2 == 0: lcd.text("PRESS [Z] START", 20, 90, BLUE)
-        lcd.show(); k = input_sys.get_input()
+        k = menu_frame(lcd, input_sys, 500 - pygame.time.get_ticks() % 500)
         if k == 'A': return 
 
-def main():
-    lcd = LCD(); c = InputController(); a = SoundEngine()
+def main(c=None):
+    init_display(); lcd = LCD(); c = c or InputController(); a = SoundEngine()
     run_title_screen(lcd, c)
     my_army = Army(slot_id=1)
     if len(my_army.units) == 0: 
@@ -1233,7 +2448,8 @@ def main():
     ]
     
     while True:
-        draw_book_bg(lcd)
+        SAVES.flush() # back on the main menu: whatever the last scene changed is on disk
+        draw_background(lcd, "BOOK")
         lcd.text(f"{my_army.units[0].name[:8]}", 10, 10, BLUE)
         lcd.text(f"${my_army.gold}", 100, 10, INK)
         lcd.text(f"Units: {len(my_army.units)}", 10, 22, GREY)
@@ -1244,7 +2460,7 @@ def main():
             col = item['col'] if i == menu_idx else GREY
             lcd.text(f"{prefix} {item['label']}", 15, y_pos, col)
             
-        lcd.show(); k = c.get_input()
+        k = menu_frame(lcd, c)
         
         if k == 'DOWN': menu_idx = (menu_idx + 1) % len(menu_options); a.sfx_blip()
         elif k == 'UP': menu_idx = (menu_idx - 1) % len(menu_options); a.sfx_blip()
@@ -1257,12 +2473,13 @@ def main():
             elif choice == "ARMY":
                 barracks_choice = 0; in_barracks = True
                 while in_barracks:
-                    draw_book_bg(lcd); lcd.text("--- BARRACKS ---", 20, 20, WHITE)
+                    SAVES.flush()
+                    draw_background(lcd, "BOOK"); lcd.text("--- BARRACKS ---", 20, 20, WHITE)
                     opts = ["TACTICS", "BLACKSMITH", "DISMISS", "BACK"]
                     for i, opt in enumerate(opts):
                         col = YELLOW if i == barracks_choice else GREY
                         lcd.text(opt, 30, 50 + (i*20), col)
-                    lcd.show(); bk = c.get_input()
+                    bk = menu_frame(lcd, c)
                     if bk == 'UP': barracks_choice = (barracks_choice - 1) % 4; a.sfx_blip()
                     elif bk == 'DOWN': barracks_choice = (barracks_choice + 1) % 4; a.sfx_blip()
                     elif bk == 'A':
@@ -1273,4 +2490,24 @@ def main():
                     elif bk == 'B': in_barracks = False
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    ap = argparse.ArgumentParser(description="WiFi Warriors: PC Edition")
+    ap.add_argument("--script", help="drive the game from a recorded input script instead of the keyboard")
+    ap.add_argument("--record", help="append every key pressed to this input script")
+    ap.add_argument("--convert", nargs=2, metavar=("SRC", "DST"), help="convert a save between JSON and binary (by DST extension) and exit")
+    ap.add_argument("--headless", action="store_true", help="run on SDL's dummy video/audio drivers (no window), e.g. with --script")
+    ap.add_argument("--profile", metavar="PREFIX", default=os.environ.get("WW_PROFILE"),
+                    help="profile battles (F3 shows the overlay) and write PREFIX.json (Chrome trace) and PREFIX.csv on exit")
+    ap.add_argument("--battle-log", metavar="DIR", help="record every siege and duel to DIR for --replay (or set WW_BATTLE_LOG)")
+    ap.add_argument("--replay", metavar="LOG", help="re-run a recorded battle headless at full speed, check its final checksum and exit")
+    ap.add_argument("--watch", action="store_true", help="with --replay, play it back on screen at normal speed instead")
+    args = ap.parse_args()
+    if args.convert: print(f"{convert_save(*args.convert)} units written to {args.convert[1]}"); sys.exit()
+    if args.battle_log: BATTLE_LOG_DIR = args.battle_log
+    if args.profile: PROFILER = FrameProfiler(); atexit.register(PROFILER.export, args.profile)
+    if args.replay and not args.watch: sys.exit(report_replay(replay_battle(args.replay)))
+    init_display(headless=args.headless or None)
+    if args.replay: sys.exit(report_replay(replay_battle(args.replay, LCD())))
+    source = ScriptSource(args.script) if args.script else KeyboardSource(record_path=args.record)
+    try: main(InputController(source))
+    except InputExhausted: pass